@@ -57,9 +57,32 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # 复用数据库连接，避免每个请求重新建立连接
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# 设置 REDIS_URL（如 redis://127.0.0.1:6379/0）后使用 Redis 作为共享缓存，
+# 会话（含购物车）改用 cached_db：读取走 Redis，数据库中仍保留一份，
+# Redis 重启、清空或按 maxmemory 淘汰键后登录状态和购物车不会丢失。
+# 未设置时保持进程内缓存 + 数据库会话；多进程下进程内缓存不共享，不能用于 cached_db。
+REDIS_URL = os.environ.get('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+    SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+# 保留 ModelBackend，以便已登录用户的旧会话继续有效
+AUTHENTICATION_BACKENDS = [
+    'shop.backends.ShopModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',},
     {'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator',},
@@ -15,8 +15,9 @@ def mask_value(value, show_chars=4):
 @admin.register(Coupon)
 class CouponAdmin(admin.ModelAdmin):
     list_display = ('masked_code', 'shop', 'discount_amount', 'min_purchase_amount', 'valid_from', 'valid_to', 'is_active')
-    list_filter = ('shop', 'is_active')
+    list_filter = (('shop', admin.RelatedOnlyFieldListFilter), 'is_active')
     search_fields = ('code', 'shop__name')
+    list_select_related = ('shop',)
     
     def masked_code(self, obj):
         return mask_value(obj.code)
@@ -40,6 +41,7 @@ class BannerAdmin(admin.ModelAdmin):
     list_filter = ('is_active',)
     search_fields = ('title',)
     raw_id_fields = ('linked_shop', 'linked_product')
+    list_select_related = ('linked_shop', 'linked_product')
 
     def get_linked_object(self, obj):
         if obj.linked_shop:
@@ -53,6 +55,7 @@ class BannerAdmin(admin.ModelAdmin):
 class ShopAdmin(admin.ModelAdmin):
     list_display = ('name', 'account', 'display_image', 'created_at')
     search_fields = ('name',)
+    list_select_related = ('account',)
 
     def display_image(self, obj):
         if obj.image:
@@ -65,51 +68,83 @@ class ProductCategoryAdmin(admin.ModelAdmin):
     list_display = ('name', 'shop')
     list_filter = ('shop',)
     search_fields = ('name',)
+    list_select_related = ('shop',)
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
     list_display = ('name', 'shop', 'category', 'price', 'stock', 'is_active')
-    list_filter = ('shop', 'category', 'is_active')
+    list_filter = (
+        ('shop', admin.RelatedOnlyFieldListFilter),
+        ('category', admin.RelatedOnlyFieldListFilter),
+        'is_active',
+    )
     search_fields = ('name', 'sku')
+    # 分类的 __str__ 会用到 shop.name
+    list_select_related = ('shop', 'category__shop')
 
 @admin.register(Address)
 class AddressAdmin(admin.ModelAdmin):
     list_display = ('user', 'address_line_1', 'city', 'is_default')
-    list_filter = ('user',)
+    list_filter = (('user', admin.RelatedOnlyFieldListFilter),)
     search_fields = ('address_line_1', 'city')
+    list_select_related = ('user',)
 
 @admin.register(Rider)
 class RiderAdmin(admin.ModelAdmin):
     list_display = ('user', 'created_at')
     search_fields = ('user__username',)
+    list_select_related = ('user',)
 
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
     extra = 0
-    readonly_fields = ('product', 'quantity')
+    readonly_fields = ('product', 'quantity', 'unit_price', 'line_total')
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('product')
 
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     list_display = ('id', 'user', 'shop', 'status', 'total', 'created_at')
-    list_filter = ('status', 'shop')
+    list_filter = ('status', ('shop', admin.RelatedOnlyFieldListFilter))
     search_fields = ('id', 'user__username')
-    readonly_fields = ('user', 'shop', 'rider', 'shipping_address', 'subtotal', 'coupon', 'discount', 'delivery_fee', 'total', 'created_at', 'paid_at', 'accepted_at', 'delivered_at')
+    readonly_fields = ('user', 'shop', 'rider', 'shipping_address', 'subtotal', 'coupon', 'discount', 'delivery_fee', 'total', 'created_at', 'paid_at', 'accepted_at', 'delivered_at', 'item_count', 'items_summary')
     inlines = [OrderItemInline]
 
+    def get_queryset(self, request):
+        # 详情页的只读外键字段会逐个渲染 __str__，一次性连表取出
+        return super().get_queryset(request).select_related(
+            'user', 'shop', 'rider__user', 'shipping_address__user', 'coupon'
+        )
+
+    def save_formset(self, request, form, formset, change):
+        super().save_formset(request, form, formset, change)
+        # 订单明细在后台被增删改后刷新订单上的冗余摘要（下单和导入在写入前已填好）
+        if formset.model is OrderItem and formset.has_changed():
+            form.instance.refresh_items_summary()
+
 @admin.register(Review)
 class ReviewAdmin(admin.ModelAdmin):
     list_display = ('order', 'user', 'rating', 'created_at')
     list_filter = ('rating',)
     search_fields = ('order__id', 'user__username')
+    # 订单的 __str__ 会用到 user.username
+    list_select_related = ('order__user', 'user')
 
 class TicketMessageInline(admin.TabularInline):
     model = TicketMessage
     extra = 1
     readonly_fields = ('created_at',)
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('user')
+
 @admin.register(SupportTicket)
 class SupportTicketAdmin(admin.ModelAdmin):
     list_display = ('id', 'subject', 'user', 'status', 'created_at')
     list_filter = ('status',)
     search_fields = ('subject', 'user__username')
     inlines = [TicketMessageInline]
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('user')
@@ -1,43 +1,123 @@
 import requests
-import json
+import re
+import hashlib
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from urllib.request import getproxies
+from django.conf import settings
 from django.core.cache import cache
 from django.db import connection
 from site_settings.models import SiteSetting
+from .json_utils import dumps_bytes as _jdumps_bytes, dumps as _jdumps, loads as _jloads
 
 # --- 0. 动态配置及缓存 ---
-def get_dynamic_setting(key, default_value):
-    cache_key = f"site_setting:{key}"
-    cached_value = cache.get(cache_key)
-    if cached_value is not None:
-        return cached_value
+# 表一旦存在就不会在运行时消失，只缓存"存在"的结果，尚未迁移时下次仍会重新检查
+_SITE_SETTING_TABLE_EXISTS = False
+
+def _site_setting_table_exists():
+    global _SITE_SETTING_TABLE_EXISTS
+    if not _SITE_SETTING_TABLE_EXISTS:
+        _SITE_SETTING_TABLE_EXISTS = SiteSetting._meta.db_table in connection.introspection.table_names()
+    return _SITE_SETTING_TABLE_EXISTS
+
+def get_dynamic_settings(keys):
+    """一次性读取多个配置，keys 为 {key: 默认值}，返回 {key: 值}。"""
+    cache_keys = {f"site_setting:{key}": key for key in keys}
+    values = {cache_keys[ck]: v for ck, v in cache.get_many(list(cache_keys)).items() if v is not None}
+    missing = [key for key in keys if key not in values]
+    if not missing:
+        return values
     try:
-        if SiteSetting._meta.db_table not in connection.introspection.table_names():
-            return default_value
-        setting = SiteSetting.objects.get(key=key)
-        value = setting.value
-        cache.set(cache_key, value, timeout=600)
-        return value
-    except SiteSetting.DoesNotExist:
-        cache.set(cache_key, default_value, timeout=60)
-        return default_value
+        if not _site_setting_table_exists():
+            return {**{key: keys[key] for key in missing}, **values}
+        found = dict(SiteSetting.objects.filter(key__in=missing).values_list('key', 'value'))
     except Exception:
-        return default_value
+        return {**{key: keys[key] for key in missing}, **values}
+    if found:
+        cache.set_many({f"site_setting:{key}": value for key, value in found.items()}, timeout=600)
+    not_found = {key: keys[key] for key in missing if key not in found}
+    if not_found:
+        cache.set_many({f"site_setting:{key}": value for key, value in not_found.items()}, timeout=60)
+    values.update(found)
+    values.update(not_found)
+    return values
+
+def get_dynamic_setting(key, default_value):
+    return get_dynamic_settings({key: default_value})[key]
 
 # --- 1. 数据库查询工具 ---
+QUERY_FETCH_SIZE = 1000
+QUERY_MAX_ROWS = 50000
+
+# 只涉及这些低频变更表的查询结果可以短时间缓存，订单等高频写入表不缓存
+QUERY_CACHEABLE_TABLES = frozenset({'shop_product', 'shop_productcategory', 'shop_shop', 'auth_user'})
+QUERY_CACHE_TIMEOUT = 30
+_TABLE_REF_RE = re.compile(r'\b(?:FROM|JOIN)\s+[`"\[]?(\w+)', re.IGNORECASE)
+_COMMA_JOIN_RE = re.compile(r'\bFROM\s+[`"\[]?\w+[`"\]]?(?:\s+(?:AS\s+)?\w+)?\s*,', re.IGNORECASE)
+
+def _is_cacheable_query(sql_query):
+    # 逗号连接的表无法可靠识别，保守起见不缓存
+    if _COMMA_JOIN_RE.search(sql_query):
+        return False
+    tables = {name.lower() for name in _TABLE_REF_RE.findall(sql_query)}
+    return bool(tables) and tables <= QUERY_CACHEABLE_TABLES
+
+_SELECT_RE = re.compile(r'\s*(SELECT|WITH)\b', re.IGNORECASE)
+_MULTI_STATEMENT_RE = re.compile(r';\s*\S')
+# WITH 子句在 PostgreSQL 中可以包含写操作，需要额外检查
+_CTE_WRITE_RE = re.compile(r'\b(?:INSERT|UPDATE|DELETE|MERGE|DROP|ALTER|CREATE|TRUNCATE)\b', re.IGNORECASE)
+
+def _is_read_only_query(sql_query):
+    match = _SELECT_RE.match(sql_query)
+    if not match or _MULTI_STATEMENT_RE.search(sql_query):
+        return False
+    if match.group(1).upper() == 'WITH' and _CTE_WRITE_RE.search(sql_query):
+        return False
+    return True
+
 def query_database(sql_query: str):
-    if not sql_query.strip().upper().startswith('SELECT'):
-        return json.dumps({"error": "为了安全，只允许执行 SELECT 查询。"})
+    if not sql_query or not _is_read_only_query(sql_query):
+        return _jdumps({"error": "为了安全，只允许执行 SELECT 查询。"})
+    if not _is_cacheable_query(sql_query):
+        return _execute_query(sql_query)
+    cache_key = f"ai_query:{hashlib.sha1(sql_query.encode('utf-8')).hexdigest()}"
+    result = cache.get(cache_key)
+    if result is None:
+        result, ok = _execute_query(sql_query, with_status=True)
+        if ok:
+            cache.set(cache_key, result, timeout=QUERY_CACHE_TIMEOUT)
+    return result
+
+def _execute_query(sql_query, with_status=False):
+    ok = False
     try:
         with connection.cursor() as cursor:
             cursor.execute(sql_query)
             columns = [col[0] for col in cursor.description]
-            results = [dict(zip(columns, row)) for row in cursor.fetchall()]
-            if not results:
-                return json.dumps({"message": "查询成功，但没有返回任何数据。"})
-            return json.dumps(results, ensure_ascii=False, indent=2)
+            # 分批读取并逐行编码，避免一次性 fetchall 和中间的大列表
+            out = bytearray(b'[')
+            row_count = 0
+            while rows := cursor.fetchmany(QUERY_FETCH_SIZE):
+                row_count += len(rows)
+                if row_count > QUERY_MAX_ROWS:
+                    result = _jdumps({"error": f"查询结果过大（超过 {QUERY_MAX_ROWS} 行），请缩小查询范围。"})
+                    break
+                for row in rows:
+                    if len(out) > 1:
+                        out += b','
+                    out += _jdumps_bytes(dict(zip(columns, row)), pretty=settings.DEBUG)
+            else:
+                ok = True
+                if not row_count:
+                    result = _jdumps({"message": "查询成功，但没有返回任何数据。"})
+                else:
+                    out += b']'
+                    result = out.decode()
     except Exception as e:
-        return json.dumps({"error": f"数据库查询出错: {str(e)}"})
+        result = _jdumps({"error": f"数据库查询出错: {str(e)}"})
+    return (result, ok) if with_status else result
 
 # --- 2. AI 交互核心 ---
 
@@ -57,7 +137,7 @@ DEFAULT_SYSTEM_PROMPT = """
 - `shop_userprofile` (用户资料表): id, user_id, ai_tokens_used, last_token_reset_date
 - `shop_rider` (外卖员表): id, user_id, created_at
 - `shop_order` (订单表): id, user_id, shop_id, rider_id, shipping_address_id, subtotal, delivery_fee, total, status, created_at, paid_at, accepted_at, delivered_at
-- `shop_orderitem` (订单项表): id, order_id, product_id, quantity
+- `shop_orderitem` (订单项表): id, order_id, product_id, quantity, unit_price (下单时成交单价), line_total (quantity * unit_price)
 - `shop_review` (评价表): id, order_id, user_id, rating, comment, created_at
 - `shop_supportticket` (客服工单表): id, user_id, subject, description, status, created_at, updated_at
 - `shop_ticketmessage` (工单消息表): id, ticket_id, user_id, message, created_at
@@ -104,25 +184,56 @@ TOOLS = [
     }
 ]
 
-def get_ai_response(conversation):
-    api_url = get_dynamic_setting('AI_ASSISTANT_URL', "")
-    api_key = get_dynamic_setting('OPENAI_API_KEY', "")
+# TOOLS 和系统提示词在每次请求中都不变，只编码一次
+_TOOLS_BYTES = _jdumps_bytes(TOOLS)
+
+@functools.lru_cache(maxsize=4)
+def _encode_system_message(content):
+    return _jdumps_bytes({"role": "system", "content": content})
+
+# 同一提示词复用同一个消息字典，调用方不得修改其内容
+@functools.lru_cache(maxsize=4)
+def _system_message(content):
+    return {"role": "system", "content": content}
+
+def _build_request_body(conversation, stream=False):
+    messages = [
+        _encode_system_message(message["content"]) if message.get("role") == "system" else _jdumps_bytes(message)
+        for message in conversation
+    ]
+    return (
+        b'{"model":"deepseek-chat","tool_choice":"auto","stream":' + (b'true' if stream else b'false')
+        + b',"tools":' + _TOOLS_BYTES
+        + b',"messages":[' + b','.join(messages) + b']}'
+    )
+
+# 复用同一个 Session，保持与 AI 服务之间的 keep-alive 连接
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=16,
+    # 只重试建立连接失败（请求尚未发出）；对话接口按次计费且非幂等，读超时和 5xx 不重试
+    max_retries=Retry(total=2, connect=2, read=0, status=0, backoff_factor=0.2),
+))
+AI_REQUEST_TIMEOUT = (5, 60)  # (连接超时, 读取超时)
+
+AI_SETTING_DEFAULTS = {'AI_ASSISTANT_URL': "", 'OPENAI_API_KEY': ""}
+
+def get_ai_response(conversation, stream=False):
+    ai_settings = get_dynamic_settings(AI_SETTING_DEFAULTS)
+    api_url = ai_settings['AI_ASSISTANT_URL']
+    api_key = ai_settings['OPENAI_API_KEY']
 
     if not api_url or not api_key:
         raise ValueError("AI服务未配置，请在后台设置API地址和密钥。")
 
     headers = {
         "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_key}"
+        "Authorization": f"Bearer {api_key}",
+        "Connection": "keep-alive",
     }
 
-    payload = {
-        "model": "deepseek-chat",
-        "messages": conversation,
-        "tools": TOOLS,
-        "tool_choice": "auto",
-        "stream": False
-    }
+    body = _build_request_body(conversation, stream)
 
     # --- 已禁用代理部分 ---
     # proxies = {}
@@ -141,43 +252,102 @@ def get_ai_response(conversation):
     #     pass
 
     # 直接不使用代理
-    response = requests.post(api_url, headers=headers, json=payload)
+    response = _SESSION.post(api_url, headers=headers, data=body, timeout=AI_REQUEST_TIMEOUT, stream=stream)
 
     response.raise_for_status()
     return response
 
-def process_ai_conversation(conversation):
+# --- 3. 工具调用执行 ---
+MAX_TOOL_WORKERS = 4
+
+def _run_tool_call(tool_call):
+    function_args = _jloads(tool_call["function"]["arguments"])
+    return query_database(sql_query=function_args.get("sql_query"))
+
+def _run_tool_call_in_thread(tool_call):
+    # 工作线程有自己的数据库连接，用完即关闭，避免连接泄漏
     try:
-        system_prompt_content = get_dynamic_setting('AI_SYSTEM_PROMPT', DEFAULT_SYSTEM_PROMPT)
-        full_conversation = [{"role": "system", "content": system_prompt_content}] + conversation
-
-        first_response = get_ai_response(full_conversation)
-        ai_response_json = first_response.json()
-
-        response_message = ai_response_json["choices"][0]["message"]
-        full_conversation.append(response_message)
-
-        if response_message.get("tool_calls"):
-            tool_results_messages = []
-            for tool_call in response_message["tool_calls"]:
-                function_name = tool_call["function"]["name"]
-                function_args = json.loads(tool_call["function"]["arguments"])
-
-                if function_name == "query_database":
-                    tool_result = query_database(sql_query=function_args.get("sql_query"))
-                    tool_results_messages.append({
-                        "role": "tool",
-                        "tool_call_id": tool_call["id"],
-                        "content": tool_result
-                    })
-
-            full_conversation.extend(tool_results_messages)
-            final_response = get_ai_response(full_conversation)
-            final_json = final_response.json()
-            content = final_json["choices"][0]["message"]["content"]
-            return content
-        else:
-            return response_message.get("content", "")
+        return _run_tool_call(tool_call)
+    finally:
+        connection.close()
+
+def _run_tool_calls(tool_calls):
+    """执行模型返回的工具调用；有多个时并发执行，结果顺序与调用顺序一致。"""
+    if len(tool_calls) <= 1:
+        return [_run_tool_call(tool_call) for tool_call in tool_calls]
+    with ThreadPoolExecutor(max_workers=min(len(tool_calls), MAX_TOOL_WORKERS)) as executor:
+        return list(executor.map(_run_tool_call_in_thread, tool_calls))
+
+def _with_system_prompt(conversation):
+    # 与 get_ai_response 需要的配置一起读取，缓存未命中时只查一次库
+    system_prompt_content = get_dynamic_settings(
+        {'AI_SYSTEM_PROMPT': DEFAULT_SYSTEM_PROMPT, **AI_SETTING_DEFAULTS}
+    )['AI_SYSTEM_PROMPT']
+    return [_system_message(system_prompt_content), *conversation]
+
+def _tool_result_messages(tool_calls):
+    db_tool_calls = [
+        tool_call for tool_call in tool_calls
+        if tool_call["function"]["name"] == "query_database"
+    ]
+    tool_results = _run_tool_calls(db_tool_calls)
+    return [
+        {"role": "tool", "tool_call_id": tool_call["id"], "content": tool_result}
+        for tool_call, tool_result in zip(db_tool_calls, tool_results)
+    ]
+
+# 出错时回答以此前缀开头，调用方只需检查第一段文本
+AI_ERROR_PREFIX = "请求AI服务时出错:"
+
+# --- 4. 流式输出 (SSE) ---
+def _iter_stream_choices(response):
+    """逐帧解析 SSE 响应 (data: {...})，产出每帧的 choices[0]。"""
+    for line in response.iter_lines():
+        if not line.startswith(b'data:'):
+            continue
+        data = line[5:].strip()
+        if data == b'[DONE]':
+            return
+        choices = _jloads(data).get("choices")
+        if choices:
+            yield choices[0]
+
+def _stream_reply(conversation, tool_calls):
+    """流式请求一次 AI 并逐段产出文本；模型返回的工具调用片段按 index 拼装进 tool_calls。"""
+    with get_ai_response(conversation, stream=True) as response:
+        for choice in _iter_stream_choices(response):
+            delta = choice.get("delta") or {}
+            if delta.get("content"):
+                yield delta["content"]
+            for fragment in delta.get("tool_calls") or ():
+                tool_call = tool_calls.setdefault(fragment.get("index", 0), {
+                    "id": "", "type": "function", "function": {"name": "", "arguments": ""},
+                })
+                if fragment.get("id"):
+                    tool_call["id"] = fragment["id"]
+                function = fragment.get("function") or {}
+                tool_call["function"]["name"] += function.get("name") or ""
+                tool_call["function"]["arguments"] += function.get("arguments") or ""
+
+def stream_ai_conversation(conversation):
+    """
+    带上系统提示词请求 AI，边生成边产出回答文本；模型调用 query_database 工具时，
+    执行查询后把结果交回模型，继续流式产出最终回答。出错时产出以 AI_ERROR_PREFIX 开头的一段文本。
+    """
+    try:
+        full_conversation = _with_system_prompt(conversation)
+
+        tool_calls = {}
+        content = []
+        for text in _stream_reply(full_conversation, tool_calls):
+            content.append(text)
+            yield text
+
+        if tool_calls:
+            tool_calls = [tool_calls[index] for index in sorted(tool_calls)]
+            full_conversation.append({"role": "assistant", "content": "".join(content) or None, "tool_calls": tool_calls})
+            full_conversation.extend(_tool_result_messages(tool_calls))
+            yield from _stream_reply(full_conversation, {})
 
     except Exception as e:
-        return f"请求AI服务时出错: {str(e)}"
+        yield f"{AI_ERROR_PREFIX} {str(e)}"
@@ -0,0 +1,20 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+
+UserModel = get_user_model()
+
+
+class ShopModelBackend(ModelBackend):
+    """
+    每个请求恢复登录用户时，一并 JOIN 出店铺、骑手和用户资料。
+    之后的 is_merchant / is_rider 判断直接读取缓存，不再各自查询一次。
+    """
+
+    def get_user(self, user_id):
+        try:
+            user = UserModel._default_manager.select_related(
+                'shop_account', 'rider_profile', 'profile'
+            ).get(pk=user_id)
+        except UserModel.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
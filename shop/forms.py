@@ -15,7 +15,10 @@ class ProductForm(forms.ModelForm):
 
     def __init__(self, shop, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.fields['category'].queryset = ProductCategory.objects.filter(shop=shop)
+        category_field = self.fields['category']
+        category_field.queryset = ProductCategory.objects.filter(shop=shop).only('id', 'name').order_by('name')
+        # 分类的 __str__ 会访问 shop.name，这里只显示名称，避免每个选项多查一次店铺
+        category_field.label_from_instance = lambda obj: obj.name
 
 class AddressForm(forms.ModelForm):
     class Meta:
@@ -0,0 +1,34 @@
+import json
+try:
+    import orjson
+except ImportError:  # 未安装 orjson 时退回标准库 json
+    orjson = None
+from django.http import HttpResponse
+
+# orjson.JSONDecodeError 本身就是 json.JSONDecodeError 的子类，两种实现都能用它捕获
+JSONDecodeError = json.JSONDecodeError
+
+
+def dumps_bytes(obj, pretty=False):
+    # Decimal 等数据库类型无法直接序列化，统一转成字符串
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if pretty else 0)
+        return orjson.dumps(obj, default=str, option=option)
+    if pretty:
+        return json.dumps(obj, ensure_ascii=False, indent=2, default=str).encode()
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=str).encode()
+
+
+def dumps(obj, pretty=False):
+    return dumps_bytes(obj, pretty).decode()
+
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def json_response(data, status=200):
+    """JsonResponse 的替代：直接用 orjson 编码成 UTF-8 字节返回。"""
+    return HttpResponse(dumps_bytes(data), content_type='application/json', status=status)
@@ -1,7 +1,10 @@
 import csv
+from itertools import islice
 from django.core.management.base import BaseCommand, CommandParser
+from django.db import transaction
 from shop.models import Product, Shop
-from django.core.exceptions import ObjectDoesNotExist
+
+IMPORT_CHUNK_SIZE = 10_000
 
 class Command(BaseCommand):
     help = '从 CSV 文件批量导入商品数据'
@@ -13,36 +16,63 @@ class Command(BaseCommand):
         csv_file_path = options['csv_file']
         self.stdout.write(self.style.SUCCESS(f'开始从 {csv_file_path} 导入商品...'))
 
+        self.shops = {}
+        created_count = updated_count = 0
         try:
-            with open(csv_file_path, mode='r', encoding='utf-8') as file:
+            with open(csv_file_path, mode='r', encoding='utf-8') as file, transaction.atomic():
                 reader = csv.DictReader(file)
-                for row in reader:
-                    try:
-                        shop_id = row['shop_id']
-                        shop = Shop.objects.get(pk=shop_id)
-                        
-                        product, created = Product.objects.update_or_create(
-                            sku=row['sku'],
-                            defaults={
-                                'shop': shop,
-                                'name': row['name'],
-                                'price': row['price'],
-                                'stock': row['stock'],
-                                'description': row.get('description', ''),
-                            }
-                        )
-                        
-                        if created:
-                            self.stdout.write(self.style.SUCCESS(f'成功创建商品: {product.name}'))
-                        else:
-                            self.stdout.write(self.style.WARNING(f'成功更新商品: {product.name}'))
-
-                    except ObjectDoesNotExist:
-                        self.stderr.write(self.style.ERROR(f"错误: 店铺 ID {row.get('shop_id')} 不存在，跳过行: {row}"))
-                    except Exception as e:
-                        self.stderr.write(self.style.ERROR(f'处理行时出错 {row}: {e}'))
-
+                # 按块读取，每块单独走批量写入，内存占用与文件大小无关
+                while rows := list(islice(reader, IMPORT_CHUNK_SIZE)):
+                    created, updated = self.import_chunk(rows)
+                    created_count += created
+                    updated_count += updated
         except FileNotFoundError:
             self.stderr.write(self.style.ERROR(f'错误: 文件 {csv_file_path} 未找到。'))
-        
+            return
+        except Exception as e:
+            self.stderr.write(self.style.ERROR(f'写入数据库时出错，本次导入已回滚: {e}'))
+            return
+
+        self.stdout.write(self.style.SUCCESS(f'成功创建商品: {created_count} 个'))
+        self.stdout.write(self.style.WARNING(f'成功更新商品: {updated_count} 个'))
         self.stdout.write(self.style.SUCCESS('导入完成。'))
+
+    def import_chunk(self, rows):
+        # 一次性加载本块涉及的店铺和已存在的商品，避免逐行查询
+        new_shop_ids = {row.get('shop_id') for row in rows} - self.shops.keys()
+        new_shop_ids = [sid for sid in new_shop_ids if sid and sid.isdigit()]
+        if new_shop_ids:
+            self.shops.update({str(s.pk): s for s in Shop.objects.filter(pk__in=new_shop_ids)})
+        existing = Product.objects.in_bulk([row['sku'] for row in rows if row.get('sku')], field_name='sku')
+
+        products_to_create = {}
+        products_to_update = {}
+        for row in rows:
+            try:
+                shop = self.shops.get(row['shop_id'])
+                if shop is None:
+                    self.stderr.write(self.style.ERROR(f"错误: 店铺 ID {row.get('shop_id')} 不存在，跳过行: {row}"))
+                    continue
+
+                sku = row['sku']
+                product = existing.get(sku) or products_to_create.get(sku) or Product(sku=sku)
+                product.shop = shop
+                product.name = row['name']
+                product.price = row['price']
+                product.stock = row['stock']
+                product.description = row.get('description', '')
+
+                if product.pk:
+                    products_to_update[sku] = product
+                else:
+                    products_to_create[sku] = product
+            except Exception as e:
+                self.stderr.write(self.style.ERROR(f'处理行时出错 {row}: {e}'))
+
+        Product.objects.bulk_create(products_to_create.values(), batch_size=1000)
+        Product.objects.bulk_update(
+            products_to_update.values(),
+            ['shop', 'name', 'price', 'stock', 'description'],
+            batch_size=1000,
+        )
+        return len(products_to_create), len(products_to_update)
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-15 21:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0006_notification_favorite'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='status',
+            field=models.CharField(choices=[('PENDING', '未支付'), ('PAID', '已支付'), ('PREPARING', '备货中'), ('READY_FOR_PICKUP', '待取货'), ('DELIVERING', '配送中'), ('DELIVERED', '已送达'), ('CANCELLED', '已取消')], db_index=True, default='PENDING', max_length=20, verbose_name='状态'),
+        ),
+    ]
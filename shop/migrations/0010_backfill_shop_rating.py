@@ -0,0 +1,25 @@
+from django.db import migrations
+from django.db.models import Avg, Count
+
+
+def backfill_shop_rating(apps, schema_editor):
+    """按已有评价回填店铺的 rating_avg / rating_count。"""
+    Shop = apps.get_model('shop', 'Shop')
+    Review = apps.get_model('shop', 'Review')
+    stats = Review.objects.values('order__shop_id').annotate(avg=Avg('rating'), count=Count('id'))
+    shops = []
+    for row in stats:
+        shop = Shop(pk=row['order__shop_id'], rating_avg=round(row['avg'], 2), rating_count=row['count'])
+        shops.append(shop)
+    Shop.objects.bulk_update(shops, ['rating_avg', 'rating_count'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0009_favorite_favorite_user_created_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_shop_rating, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.6 on 2026-10-15 21:57
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def dedupe_default_addresses(apps, schema_editor):
+    """每个用户只保留最新的一个默认地址，以便添加唯一约束。"""
+    Address = apps.get_model('shop', 'Address')
+    keep_ids = (
+        Address.objects.filter(is_default=True)
+        .values('user_id')
+        .annotate(keep_id=Max('id'))
+        .values_list('keep_id', flat=True)
+    )
+    Address.objects.filter(is_default=True).exclude(id__in=list(keep_ids)).update(is_default=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0010_backfill_shop_rating'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_default_addresses, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='address',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_default', True)), fields=('user',), name='one_default_address_per_user'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.6 on 2026-10-15 22:00
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0012_notification_unread_ticket_status_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='userprofile',
+            name='last_token_reset_date',
+            field=models.DateField(default=django.utils.timezone.localdate, verbose_name='最后Token重置日期'),
+        ),
+    ]
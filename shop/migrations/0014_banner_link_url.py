@@ -0,0 +1,34 @@
+# Generated by Django 5.2.6 on 2026-10-15 22:01
+
+from django.db import migrations, models
+from django.urls import reverse
+
+
+def backfill_link_url(apps, schema_editor):
+    """为已有横幅计算跳转链接。"""
+    Banner = apps.get_model('shop', 'Banner')
+    banners = list(Banner.objects.only('id', 'linked_shop_id', 'linked_product_id'))
+    for banner in banners:
+        if banner.linked_shop_id:
+            banner.link_url = reverse('shop:shop_detail', args=[banner.linked_shop_id])
+        elif banner.linked_product_id:
+            banner.link_url = reverse('shop:product_detail', args=[banner.linked_product_id])
+        else:
+            banner.link_url = '#'
+    Banner.objects.bulk_update(banners, ['link_url'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0013_userprofile_reset_date_localdate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='banner',
+            name='link_url',
+            field=models.CharField(blank=True, editable=False, max_length=200, verbose_name='跳转链接'),
+        ),
+        migrations.RunPython(backfill_link_url, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.2.6 on 2026-10-15 22:02
+
+import django.db.models.functions.text
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import Upper
+
+
+def check_case_insensitive_coupon_codes(apps, schema_editor):
+    """
+    原 code 字段只区分大小写唯一，表中可能已有 "SAVE10" 与 "save10" 这类仅大小写不同的优惠码。
+    这些优惠码可能已发给用户，不能自动改名或合并，发现冲突时列出后中止迁移，由管理员手动处理。
+    """
+    Coupon = apps.get_model('shop', 'Coupon')
+    duplicated = (
+        Coupon.objects.annotate(code_upper=Upper('code'))
+        .values('code_upper').annotate(n=Count('id')).filter(n__gt=1)
+        .values_list('code_upper', flat=True)
+    )
+    conflicts = {}
+    for code_upper, code in (
+        Coupon.objects.annotate(code_upper=Upper('code'))
+        .filter(code_upper__in=list(duplicated)).order_by('code_upper', 'pk')
+        .values_list('code_upper', 'code')
+    ):
+        conflicts.setdefault(code_upper, []).append(code)
+    if conflicts:
+        lines = '\n'.join(f"  {', '.join(codes)}" for codes in conflicts.values())
+        raise RuntimeError(
+            "以下优惠码仅大小写不同，无法添加不区分大小写的唯一约束 coupon_code_ci_uniq。\n"
+            f"请在后台修改或删除其中多余的优惠码后重新执行迁移：\n{lines}"
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0014_banner_link_url'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(check_case_insensitive_coupon_codes, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='coupon',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Upper('code'), name='coupon_code_ci_uniq', violation_error_message='该优惠码已存在（不区分大小写）。'),
+        ),
+        migrations.AddConstraint(
+            model_name='favorite',
+            constraint=models.UniqueConstraint(fields=('user', 'product'), name='favorite_user_product_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='productcategory',
+            constraint=models.UniqueConstraint(fields=('shop', 'name'), name='category_shop_name_uniq'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='favorite',
+            unique_together=set(),
+        ),
+        migrations.AlterUniqueTogether(
+            name='productcategory',
+            unique_together=set(),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.6 on 2026-10-15 22:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+SALES_STATUSES = ['PAID', 'PREPARING', 'READY_FOR_PICKUP', 'DELIVERING', 'DELIVERED']
+
+
+def backfill_daily_sales(apps, schema_editor):
+    """按已有订单回填每日销售汇总。"""
+    Order = apps.get_model('shop', 'Order')
+    DailySalesRollup = apps.get_model('shop', 'DailySalesRollup')
+    rows = (
+        Order.objects.filter(status__in=SALES_STATUSES, paid_at__isnull=False)
+        .annotate(day=TruncDate('paid_at'))
+        .values('shop_id', 'day')
+        .annotate(gross=Sum('total'), orders=Count('id'))
+        .order_by()
+    )
+    DailySalesRollup.objects.bulk_create(
+        (DailySalesRollup(shop_id=r['shop_id'], date=r['day'], gross=r['gross'], orders=r['orders']) for r in rows),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0015_unique_constraints_coupon_code_ci'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='日期')),
+                ('gross', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='销售额')),
+                ('orders', models.IntegerField(default=0, verbose_name='订单数')),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='shop.shop', verbose_name='店铺')),
+            ],
+            options={
+                'verbose_name': '每日销售汇总',
+                'verbose_name_plural': '每日销售汇总',
+                'constraints': [models.UniqueConstraint(fields=('shop', 'date'), name='daily_sales_shop_date_uniq')],
+            },
+        ),
+        migrations.RunPython(backfill_daily_sales, migrations.RunPython.noop),
+    ]
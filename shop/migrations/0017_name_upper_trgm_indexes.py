@@ -0,0 +1,38 @@
+from django.db import migrations
+
+
+# Django 在 PostgreSQL 上把 icontains 编译为 UPPER("name"::text) LIKE UPPER(%s)，
+# 直接建在 name 上的 trigram 索引无法命中，需改为 UPPER(name) 表达式索引。
+# 店铺名称同样建立索引；非 PostgreSQL 数据库直接跳过。
+def create_upper_trgm_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute('DROP INDEX IF EXISTS product_name_trgm')
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS product_name_upper_trgm ON shop_product USING gin ((UPPER(name::text)) gin_trgm_ops)'
+    )
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS shop_name_upper_trgm ON shop_shop USING gin ((UPPER(name::text)) gin_trgm_ops)'
+    )
+
+
+def drop_upper_trgm_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS product_name_upper_trgm')
+    schema_editor.execute('DROP INDEX IF EXISTS shop_name_upper_trgm')
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS product_name_trgm ON shop_product USING gin (name gin_trgm_ops)'
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0016_daily_sales_rollup'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_upper_trgm_indexes, drop_upper_trgm_indexes),
+    ]
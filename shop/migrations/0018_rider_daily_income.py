@@ -0,0 +1,49 @@
+# Generated by Django 5.2.6 on 2026-10-15 22:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+
+def backfill_rider_income(apps, schema_editor):
+    """按已送达订单回填骑手每日收入。"""
+    Order = apps.get_model('shop', 'Order')
+    RiderDailyIncome = apps.get_model('shop', 'RiderDailyIncome')
+    rows = (
+        Order.objects.filter(status='DELIVERED', rider__isnull=False, delivered_at__isnull=False)
+        .annotate(day=TruncDate('delivered_at'))
+        .values('rider_id', 'day')
+        .annotate(income=Sum('delivery_fee'), orders=Count('id'))
+        .order_by()
+    )
+    RiderDailyIncome.objects.bulk_create(
+        (RiderDailyIncome(rider_id=r['rider_id'], date=r['day'], income=r['income'], orders=r['orders']) for r in rows),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0017_name_upper_trgm_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RiderDailyIncome',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='日期')),
+                ('income', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='配送收入')),
+                ('orders', models.IntegerField(default=0, verbose_name='完成单数')),
+                ('rider', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_income', to='shop.rider', verbose_name='外卖员')),
+            ],
+            options={
+                'verbose_name': '骑手每日收入',
+                'verbose_name_plural': '骑手每日收入',
+                'constraints': [models.UniqueConstraint(fields=('rider', 'date'), name='rider_income_rider_date_uniq')],
+            },
+        ),
+        migrations.RunPython(backfill_rider_income, migrations.RunPython.noop),
+    ]
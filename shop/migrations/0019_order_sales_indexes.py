@@ -0,0 +1,27 @@
+# Generated by Django 5.2.6 on 2026-10-15 22:12
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0018_rider_daily_income'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['shop', 'paid_at', 'status'], name='order_shop_paid_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('status__in', ['PAID', 'PREPARING', 'READY_FOR_PICKUP', 'DELIVERING', 'DELIVERED'])), fields=['shop', 'paid_at'], name='order_sales_shop_paid_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orderitem',
+            index=models.Index(fields=['order', 'product'], name='orderitem_order_product_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.6 on 2026-10-15 23:40
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_unit_price(apps, schema_editor):
+    """历史订单项没有记录成交价，以商品当前价格回填。"""
+    OrderItem = apps.get_model('shop', 'OrderItem')
+    Product = apps.get_model('shop', 'Product')
+    OrderItem.objects.update(
+        unit_price=Subquery(Product.objects.filter(pk=OuterRef('product_id')).values('price')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0020_orderitem_product_order_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10, verbose_name='成交单价'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_unit_price, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='orderitem',
+            name='line_total',
+            field=models.GeneratedField(db_persist=True, expression=models.F('quantity') * models.F('unit_price'), output_field=models.DecimalField(decimal_places=2, max_digits=12, verbose_name='小计')),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-15 22:19
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0021_orderitem_unit_price_line_total'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='order',
+            name='order_rider_status_idx',
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['rider', 'status', '-delivered_at'], name='order_rider_status_deliv_idx'),
+        ),
+    ]
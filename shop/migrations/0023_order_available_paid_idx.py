@@ -0,0 +1,19 @@
+# Generated by Django 5.2.6 on 2026-10-15 22:25
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0022_order_rider_status_delivered_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('rider__isnull', True), ('status', 'PAID')), fields=['paid_at'], name='order_available_paid_idx'),
+        ),
+    ]
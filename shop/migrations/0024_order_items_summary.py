@@ -0,0 +1,46 @@
+# Generated by Django 5.2.6 on 2026-10-15 22:29
+
+from itertools import groupby
+
+from django.db import migrations, models
+
+
+def backfill_items_summary(apps, schema_editor):
+    """按现有订单明细回填件数和商品摘要（与 Order.set_items_summary 规则一致）。"""
+    Order = apps.get_model('shop', 'Order')
+    OrderItem = apps.get_model('shop', 'OrderItem')
+    rows = OrderItem.objects.order_by('order_id', 'pk').values_list('order_id', 'product__name', 'quantity').iterator()
+    batch = []
+    for order_id, items in groupby(rows, key=lambda row: row[0]):
+        items = list(items)
+        summary = '、'.join(f"{name} x{quantity}" for _, name, quantity in items)
+        batch.append(Order(
+            pk=order_id,
+            item_count=sum(quantity for _, _, quantity in items),
+            items_summary=summary if len(summary) <= 255 else summary[:254] + '…',
+        ))
+        if len(batch) >= 1000:
+            Order.objects.bulk_update(batch, ['item_count', 'items_summary'])
+            batch = []
+    Order.objects.bulk_update(batch, ['item_count', 'items_summary'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0023_order_available_paid_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='商品件数'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='items_summary',
+            field=models.CharField(blank=True, default='', max_length=255, verbose_name='商品摘要'),
+        ),
+        migrations.RunPython(backfill_items_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.6 on 2026-10-15 22:39
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0024_order_items_summary'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='order',
+            name='order_paid_at_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='order',
+            name='order_delivered_at_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='order',
+            name='order_shop_paid_status_idx',
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='rider',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='orders', to='shop.rider', verbose_name='外卖员'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='shop',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='orders', to='shop.shop', verbose_name='店铺'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='status',
+            field=models.CharField(choices=[('PENDING', '未支付'), ('PAID', '已支付'), ('PREPARING', '备货中'), ('READY_FOR_PICKUP', '待取货'), ('DELIVERING', '配送中'), ('DELIVERED', '已送达'), ('CANCELLED', '已取消')], default='PENDING', max_length=20, verbose_name='状态'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='orders', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
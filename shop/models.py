@@ -1,4 +1,6 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Q, Prefetch
+from django.db.models.functions import Upper
 from django.contrib.auth.models import User
 from django.urls import reverse
 from django.core.validators import MinValueValidator, MaxValueValidator
@@ -8,6 +10,27 @@ from PIL import Image
 from io import BytesIO
 from django.core.files.base import ContentFile
 
+def compress_image(image_file):
+    """把上传的图片统一转成最大宽度 1024 的 JPEG，返回 ContentFile。"""
+    # 打开图片
+    img = Image.open(image_file)
+
+    # 如果图片是 RGBA，转换为 RGB
+    if img.mode == 'RGBA':
+        img = img.convert('RGB')
+
+    # 设置新的尺寸，例如最大宽度为1024，高度按比例缩放
+    max_width = 1024
+    if img.width > max_width:
+        ratio = max_width / img.width
+        new_height = int(img.height * ratio)
+        img = img.resize((max_width, new_height), Image.LANCZOS)
+
+    # 压缩图片
+    buffer = BytesIO()
+    img.save(buffer, format='JPEG', quality=90)
+    return ContentFile(buffer.getvalue())
+
 # ===== 店铺与商品 =====
 class Shop(models.Model):
     name = models.CharField('店铺名称', max_length=255)
@@ -31,30 +54,11 @@ class Shop(models.Model):
 
     def save(self, *args, **kwargs):
         if self.image:
-            # 打开图片
-            img = Image.open(self.image)
-
-            # 如果图片是 RGBA，转换为 RGB
-            if img.mode == 'RGBA':
-                img = img.convert('RGB')
-
-            # 设置新的尺寸，例如最大宽度为1024，高度按比例缩放
-            max_width = 1024
-            if img.width > max_width:
-                ratio = max_width / img.width
-                new_height = int(img.height * ratio)
-                img = img.resize((max_width, new_height), Image.LANCZOS)
-
-            # 压缩图片
-            buffer = BytesIO()
-            img.save(buffer, format='JPEG', quality=90)
-            buffer.seek(0)
-
             # 创建一个新的文件名
             image_name = f"{self.image.name.split('.')[0]}.jpg"
             
             # 用压缩后的图片替换原来的图片
-            self.image.save(image_name, ContentFile(buffer.getvalue()), save=False)
+            self.image.save(image_name, compress_image(self.image), save=False)
 
         super().save(*args, **kwargs)
 
@@ -66,7 +70,9 @@ class ProductCategory(models.Model):
     class Meta:
         verbose_name = '商品分类'
         verbose_name_plural = '商品分类'
-        unique_together = ('shop', 'name')
+        constraints = [
+            models.UniqueConstraint(fields=['shop', 'name'], name='category_shop_name_uniq'),
+        ]
 
     def __str__(self):
         return f'{self.shop.name} - {self.name}'
@@ -88,6 +94,9 @@ class Product(models.Model):
         ordering = ['-created_at']
         verbose_name = '商品'
         verbose_name_plural = '商品'
+        indexes = [
+            models.Index(fields=['shop', 'is_active'], name='product_shop_active_idx'),
+        ]
 
     def __str__(self):
         return f'{self.name} ({self.sku})'
@@ -97,39 +106,29 @@ class Product(models.Model):
 
     def save(self, *args, **kwargs):
         if self.image:
-            # 打开图片
-            img = Image.open(self.image)
-
-            # 如果图片是 RGBA，转换为 RGB
-            if img.mode == 'RGBA':
-                img = img.convert('RGB')
-
-            # 设置新的尺寸，例如最大宽度为1024，高度按比例缩放
-            max_width = 1024
-            if img.width > max_width:
-                ratio = max_width / img.width
-                new_height = int(img.height * ratio)
-                img = img.resize((max_width, new_height), Image.LANCZOS)
-
-            # 压缩图片
-            buffer = BytesIO()
-            img.save(buffer, format='JPEG', quality=90)
-            buffer.seek(0)
-
             # 创建一个新的文件名
             image_name = f"{self.image.name.split('.')[0]}.jpg"
             
             # 用压缩后的图片替换原来的图片
-            self.image.save(image_name, ContentFile(buffer.getvalue()), save=False)
+            self.image.save(image_name, compress_image(self.image), save=False)
 
         super().save(*args, **kwargs)
 
+    @classmethod
+    def store_image(cls, image_file):
+        """压缩并写入存储一次，返回可直接赋给 image 字段的存储路径（供批量更新使用）。"""
+        field = cls._meta.get_field('image')
+        image_name = f"{image_file.name.rsplit('.', 1)[0]}.jpg"
+        return field.storage.save(field.generate_filename(None, image_name), compress_image(image_file))
+
 # ===== 平台管理 =====
 class Banner(models.Model):
     title = models.CharField('横幅标题', max_length=100, help_text="仅用于后台识别", default='默认标题')
     image = models.ImageField('图片', upload_to='banners/')
     linked_shop = models.ForeignKey(Shop, on_delete=models.CASCADE, verbose_name='跳转店铺', null=True, blank=True, help_text="选择一个店铺，将优先于商品链接")
     linked_product = models.ForeignKey(Product, on_delete=models.CASCADE, verbose_name='跳转商品', null=True, blank=True, help_text="选择一个商品")
+    # 保存时根据跳转目标计算，首页渲染时无需再查询店铺/商品
+    link_url = models.CharField('跳转链接', max_length=200, blank=True, editable=False)
     is_active = models.BooleanField('是否激活', default=True)
     created_at = models.DateTimeField('创建时间', auto_now_add=True)
 
@@ -168,6 +167,10 @@ class Banner(models.Model):
             # 用压缩后的图片替换原来的图片
             self.image.save(image_name, ContentFile(buffer.getvalue()), save=False)
 
+        self.link_url = self.build_link_url()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'linked_shop', 'linked_product'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'link_url'}
         super().save(*args, **kwargs)
 
     def clean(self):
@@ -176,13 +179,17 @@ class Banner(models.Model):
         if not self.linked_shop and not self.linked_product:
             raise ValidationError("必须选择一个店铺或商品作为跳转链接。")
 
-    def get_link_url(self):
-        if self.linked_shop:
-            return self.linked_shop.get_absolute_url()
-        if self.linked_product:
-            return self.linked_product.get_absolute_url()
+    def build_link_url(self):
+        """按外键 id 反查跳转链接，不加载关联对象"""
+        if self.linked_shop_id:
+            return reverse('shop:shop_detail', args=[self.linked_shop_id])
+        if self.linked_product_id:
+            return reverse('shop:product_detail', args=[self.linked_product_id])
         return "#"
 
+    def get_link_url(self):
+        return self.link_url or self.build_link_url()
+
 class Coupon(models.Model):
     shop = models.ForeignKey(Shop, on_delete=models.CASCADE, related_name='coupons', verbose_name='所属店铺')
     code = models.CharField('优惠码', max_length=50, unique=True)
@@ -195,6 +202,11 @@ class Coupon(models.Model):
     class Meta:
         verbose_name = '优惠券'
         verbose_name_plural = '优惠券'
+        constraints = [
+            # 结账时按 code__iexact 查找优惠券；PostgreSQL 上 iexact 生成 UPPER(code) = UPPER(%s)，
+            # 此表达式唯一索引既能命中该查询，也防止出现仅大小写不同的重复优惠码
+            models.UniqueConstraint(Upper('code'), name='coupon_code_ci_uniq', violation_error_message='该优惠码已存在（不区分大小写）。'),
+        ]
 
     def __str__(self):
         return self.code
@@ -214,24 +226,51 @@ class Address(models.Model):
         verbose_name = '收货地址'
         verbose_name_plural = '收货地址'
         ordering = ['-is_default']
+        constraints = [
+            # 每个用户最多一个默认地址，由数据库保证
+            models.UniqueConstraint(fields=['user'], condition=Q(is_default=True), name='one_default_address_per_user'),
+        ]
 
     def __str__(self):
         return f'{self.user.username} - {self.address_line_1}'
 
+    def save(self, *args, **kwargs):
+        if not self.is_default:
+            return super().save(*args, **kwargs)
+        # 先取消该用户其他默认地址，否则会违反唯一约束
+        with transaction.atomic():
+            Address.objects.filter(user_id=self.user_id, is_default=True).exclude(pk=self.pk).update(is_default=False)
+            super().save(*args, **kwargs)
+
+    @classmethod
+    def set_default(cls, user, pk):
+        """把指定地址设为默认，同时取消其余地址的默认标记。"""
+        # 唯一索引按行即时检查，单条 CASE UPDATE 可能先写入新默认而冲突，故拆成先清后设
+        with transaction.atomic():
+            cls.objects.filter(user=user, is_default=True).exclude(pk=pk).update(is_default=False)
+            return cls.objects.filter(user=user, pk=pk).update(is_default=True)
+
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
     ai_tokens_used = models.PositiveIntegerField('今日AI-Tokens消耗', default=0)
-    last_token_reset_date = models.DateField('最后Token重置日期', default=timezone.now)
+    last_token_reset_date = models.DateField('最后Token重置日期', default=timezone.localdate)
 
     def __str__(self):
         return f'{self.user.username} 的资料'
 
     def reset_tokens_if_needed(self):
-        today = timezone.now().date()
-        if self.last_token_reset_date < today:
+        today = timezone.localdate()
+        if self.last_token_reset_date >= today:
+            return
+        # 带日期条件的单条 UPDATE：只写两列、不触发信号，并发请求也只会重置一次
+        updated = UserProfile.objects.filter(pk=self.pk, last_token_reset_date__lt=today).update(
+            ai_tokens_used=0, last_token_reset_date=today
+        )
+        if updated:
             self.ai_tokens_used = 0
             self.last_token_reset_date = today
-            self.save()
+        else:
+            self.refresh_from_db(fields=['ai_tokens_used', 'last_token_reset_date'])
 
 class Favorite(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='favorites', verbose_name='用户')
@@ -241,8 +280,13 @@ class Favorite(models.Model):
     class Meta:
         verbose_name = '收藏'
         verbose_name_plural = '收藏'
-        unique_together = ('user', 'product')
         ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'product'], name='favorite_user_product_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='favorite_user_created_idx'),
+        ]
 
     def __str__(self):
         return f'{self.user.username} 收藏了 {self.product.name}'
@@ -259,19 +303,31 @@ class Rider(models.Model):
         return f"外卖员: {self.user.username}"
 
 # ===== 订单与评价 =====
+class OrderQuerySet(models.QuerySet):
+    def with_related(self):
+        """一次性带出订单页面常用的关联对象和订单明细，避免 N+1 查询"""
+        return self.select_related('user', 'shop', 'rider__user', 'shipping_address', 'coupon').prefetch_related(
+            Prefetch('items', queryset=OrderItem.objects.select_related('product'))
+        )
+
 class Order(models.Model):
-    STATUS_CHOICES = [
-        ('PENDING', '未支付'),
-        ('PAID', '已支付'),
-        ('PREPARING', '备货中'),
-        ('READY_FOR_PICKUP', '待取货'),
-        ('DELIVERING', '配送中'),
-        ('DELIVERED', '已送达'),
-        ('CANCELLED', '已取消'),
-    ]
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='orders')
-    shop = models.ForeignKey(Shop, on_delete=models.CASCADE, related_name='orders', verbose_name='店铺')
-    rider = models.ForeignKey(Rider, on_delete=models.SET_NULL, related_name='orders', verbose_name='外卖员', null=True, blank=True)
+    class Status(models.TextChoices):
+        PENDING = 'PENDING', '未支付'
+        PAID = 'PAID', '已支付'
+        PREPARING = 'PREPARING', '备货中'
+        READY_FOR_PICKUP = 'READY_FOR_PICKUP', '待取货'
+        DELIVERING = 'DELIVERING', '配送中'
+        DELIVERED = 'DELIVERED', '已送达'
+        CANCELLED = 'CANCELLED', '已取消'
+
+    STATUS_CHOICES = Status.choices
+    # 计入销售额的状态（已支付且未取消），与商家报表口径一致
+    SALES_STATUSES = frozenset({Status.PAID, Status.PREPARING, Status.READY_FOR_PICKUP, Status.DELIVERING, Status.DELIVERED})
+
+    # user / shop / rider 均是下方复合索引的首列，不再单独建外键索引
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='orders', db_index=False)
+    shop = models.ForeignKey(Shop, on_delete=models.CASCADE, related_name='orders', verbose_name='店铺', db_index=False)
+    rider = models.ForeignKey(Rider, on_delete=models.SET_NULL, related_name='orders', verbose_name='外卖员', null=True, blank=True, db_index=False)
     shipping_address = models.ForeignKey(Address, on_delete=models.SET_NULL, verbose_name='收货地址', null=True, blank=True)
     
     subtotal = models.DecimalField('商品总价', max_digits=12, decimal_places=2)
@@ -280,24 +336,89 @@ class Order(models.Model):
     delivery_fee = models.DecimalField('配送费', max_digits=10, decimal_places=2, default=1.00)
     total = models.DecimalField('订单总额', max_digits=12, decimal_places=2)
 
-    status = models.CharField('状态', max_length=20, choices=STATUS_CHOICES, default='PENDING')
+    status = models.CharField('状态', max_length=20, choices=STATUS_CHOICES, default=Status.PENDING)
     created_at = models.DateTimeField('创建时间', auto_now_add=True)
     paid_at = models.DateTimeField('支付时间', null=True, blank=True)
     accepted_at = models.DateTimeField('接单时间', null=True, blank=True)
     delivered_at = models.DateTimeField('送达时间', null=True, blank=True)
+    # 订单明细的冗余摘要，订单列表直接显示，无需再取明细和商品
+    item_count = models.PositiveIntegerField('商品件数', default=0)
+    items_summary = models.CharField('商品摘要', max_length=255, blank=True, default='')
+
+    objects = OrderQuerySet.as_manager()
 
     class Meta:
         ordering = ['-created_at']
         verbose_name = '订单'
         verbose_name_plural = '订单'
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='order_user_created_idx'),
+            models.Index(fields=['shop', 'status', '-created_at'], name='order_shop_status_created_idx'),
+            # 骑手历史按送达时间倒序；前缀 (rider, status) 同时服务骑手的进行中订单查询
+            models.Index(fields=['rider', 'status', '-delivered_at'], name='order_rider_status_deliv_idx'),
+            models.Index(fields=['status', '-created_at'], name='order_status_created_idx'),
+            # 只覆盖进行中的订单，商家待处理列表扫描的行数远小于全表
+            models.Index(
+                fields=['shop', '-created_at'],
+                condition=Q(status__in=['PAID', 'PREPARING', 'READY_FOR_PICKUP', 'DELIVERING']),
+                name='order_active_shop_idx',
+            ),
+            # 销售报表按 店铺 + 支付时间范围 过滤已支付的订单
+            models.Index(
+                fields=['shop', 'paid_at'],
+                condition=Q(status__in=['PAID', 'PREPARING', 'READY_FOR_PICKUP', 'DELIVERING', 'DELIVERED']),
+                name='order_sales_shop_paid_idx',
+            ),
+            # 骑手抢单池：已支付且未分配骑手，按支付时间先后排列
+            models.Index(
+                fields=['paid_at'],
+                condition=Q(status='PAID', rider__isnull=True),
+                name='order_available_paid_idx',
+            ),
+        ]
 
     def __str__(self):
         return f"Order#{self.pk} ({self.user.username})"
 
+    def set_items_summary(self, items):
+        """按订单明细（需已带 product）填写件数和商品摘要，不保存。"""
+        self.item_count = sum(item.quantity for item in items)
+        summary = '、'.join(f"{item.product.name} x{item.quantity}" for item in items)
+        max_length = self._meta.get_field('items_summary').max_length
+        self.items_summary = summary if len(summary) <= max_length else summary[:max_length - 1] + '…'
+
+    def refresh_items_summary(self):
+        """明细被单独增删改后，按数据库中的明细重新计算摘要并写回。"""
+        self.set_items_summary(list(self.items.select_related('product').only('quantity', 'product__name')))
+        Order.objects.filter(pk=self.pk).update(item_count=self.item_count, items_summary=self.items_summary)
+
+    def transition_to(self, new_status, **fields):
+        """
+        切换订单状态，并同时写入相关字段（如 paid_at、rider）。
+        只 UPDATE 状态和传入的字段，信号处理器据 update_fields 判断是否需要发送通知。
+        """
+        self.status = new_status
+        for name, value in fields.items():
+            setattr(self, name, value)
+        self.save(update_fields=['status', *fields])
+
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
     product = models.ForeignKey(Product, on_delete=models.PROTECT, verbose_name='商品')
     quantity = models.PositiveIntegerField('数量', default=1)
+    # 下单时的成交单价；商品之后改价不影响历史订单和销售额统计
+    unit_price = models.DecimalField('成交单价', max_digits=10, decimal_places=2)
+    line_total = models.GeneratedField(
+        expression=F('quantity') * F('unit_price'),
+        output_field=models.DecimalField('小计', max_digits=12, decimal_places=2),
+        db_persist=True,
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['order', 'product'], name='orderitem_order_product_idx'),
+            models.Index(fields=['product', 'order'], name='orderitem_product_order_idx'),
+        ]
 
     def __str__(self):
         return f"Order#{self.order.pk}: {self.product.name} x {self.quantity}"
@@ -314,17 +435,56 @@ class Review(models.Model):
         verbose_name_plural = '订单评价'
         unique_together = ('order', 'user')
 
+# ===== 销售统计 =====
+class DailySalesRollup(models.Model):
+    """
+    店铺按支付日期汇总的销售额与订单数，由订单信号增量维护，
+    报表和图表直接读取，无需每次对订单表做 SUM/GROUP BY。
+    """
+    shop = models.ForeignKey(Shop, on_delete=models.CASCADE, related_name='daily_sales', verbose_name='店铺')
+    date = models.DateField('日期')
+    gross = models.DecimalField('销售额', max_digits=14, decimal_places=2, default=0)
+    orders = models.IntegerField('订单数', default=0)
+
+    class Meta:
+        verbose_name = '每日销售汇总'
+        verbose_name_plural = '每日销售汇总'
+        constraints = [
+            models.UniqueConstraint(fields=['shop', 'date'], name='daily_sales_shop_date_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.shop_id} {self.date}: {self.gross}'
+
+class RiderDailyIncome(models.Model):
+    """骑手按送达日期汇总的配送费收入与单数，由订单信号增量维护。"""
+    rider = models.ForeignKey(Rider, on_delete=models.CASCADE, related_name='daily_income', verbose_name='外卖员')
+    date = models.DateField('日期')
+    income = models.DecimalField('配送收入', max_digits=12, decimal_places=2, default=0)
+    orders = models.IntegerField('完成单数', default=0)
+
+    class Meta:
+        verbose_name = '骑手每日收入'
+        verbose_name_plural = '骑手每日收入'
+        constraints = [
+            models.UniqueConstraint(fields=['rider', 'date'], name='rider_income_rider_date_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.rider_id} {self.date}: {self.income}'
+
 # ===== 客服工单 =====
 class SupportTicket(models.Model):
-    STATUS_CHOICES = [
-        ('OPEN', '待处理'),
-        ('IN_PROGRESS', '处理中'),
-        ('CLOSED', '已关闭'),
-    ]
+    class Status(models.TextChoices):
+        OPEN = 'OPEN', '待处理'
+        IN_PROGRESS = 'IN_PROGRESS', '处理中'
+        CLOSED = 'CLOSED', '已关闭'
+
+    STATUS_CHOICES = Status.choices
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='support_tickets', verbose_name='用户')
     subject = models.CharField('主题', max_length=255)
     description = models.TextField('问题描述')
-    status = models.CharField('状态', max_length=20, choices=STATUS_CHOICES, default='OPEN')
+    status = models.CharField('状态', max_length=20, choices=STATUS_CHOICES, default=Status.OPEN)
     created_at = models.DateTimeField('创建时间', auto_now_add=True)
     updated_at = models.DateTimeField('更新时间', auto_now=True)
 
@@ -332,6 +492,9 @@ class SupportTicket(models.Model):
         verbose_name = '客服工单'
         verbose_name_plural = '客服工单'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', '-created_at'], name='ticket_status_created_idx'),
+        ]
 
     def __str__(self):
         return f'工单 #{self.pk} - {self.subject}'
@@ -362,6 +525,11 @@ class Notification(models.Model):
         verbose_name = '通知'
         verbose_name_plural = '通知'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['recipient', 'is_read', '-created_at'], name='notif_recipient_read_idx'),
+            # 绝大多数通知都已读，未读数角标只需扫描这个小得多的部分索引
+            models.Index(fields=['recipient', '-created_at'], condition=Q(is_read=False), name='notif_unread_idx'),
+        ]
 
     def __str__(self):
         return f'给 {self.recipient.username} 的通知: {self.message[:20]}'
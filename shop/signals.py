@@ -1,7 +1,58 @@
-from django.db.models.signals import post_save
+from collections import defaultdict
+from functools import lru_cache
+from django.db.models import Avg, Count, F, FloatField
+from django.db.models.functions import Cast
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
 from django.urls import reverse
-from .models import Order, Notification
+from django.utils import timezone
+from .models import Order, Notification, Review, Rider, Shop, DailySalesRollup, RiderDailyIncome
+
+# 各角色在不同订单状态下的通知模板，模块加载时构建一次
+_CUSTOMER_TEMPLATES = {
+    Order.Status.PAID: "您的订单 #{pk} 已支付成功，商家正在备货。",
+    Order.Status.PREPARING: "商家已接单，您的订单 #{pk} 正在备货中。",
+    Order.Status.READY_FOR_PICKUP: "您的订单 #{pk} 已备货完成，等待骑手取货。",
+    Order.Status.DELIVERING: "骑手已取货，您的订单 #{pk} 正在飞速向您奔来！",
+    Order.Status.DELIVERED: "您的订单 #{pk} 已送达，欢迎再次光临！",
+    Order.Status.CANCELLED: "很遗憾，您的订单 #{pk} 已被取消。",
+}
+_MERCHANT_TEMPLATES = {
+    Order.Status.PAID: "您有新的待处理订单 #{pk}，请尽快备货。",
+}
+# 注意：这里我们假设骑手是在接单时（accept_order视图）被分配的，
+# 那个时刻订单状态会从 PAID 变为 DELIVERING。
+# 如果有其他状态需要通知骑手，也可以在这里添加。
+_RIDER_TEMPLATES = {
+    Order.Status.CANCELLED: "订单 #{pk} 已被取消，您无需再进行配送。",
+}
+
+
+@lru_cache(maxsize=1)
+def _order_detail_link_parts():
+    """
+    反查一次订单详情的 URL 并拆成 pk 前后两段，之后只需拼接字符串。
+    URL 配置在信号模块加载时可能尚未就绪，因此延迟到首次使用时计算。
+    """
+    parts = reverse('shop:order_detail', kwargs={'pk': 0}).rsplit('0', 1)
+    return tuple(parts) if len(parts) == 2 else None
+
+
+def _order_detail_link(pk):
+    parts = _order_detail_link_parts()
+    if parts is None:
+        return reverse('shop:order_detail', kwargs={'pk': pk})
+    return f"{parts[0]}{pk}{parts[1]}"
+
+
+@receiver(pre_save, sender=Order)
+def capture_old_order_status(sender, instance, **kwargs):
+    """保存前记下数据库中的旧状态，供 post_save 判断状态是否真的变化。"""
+    update_fields = kwargs.get('update_fields')
+    if instance._state.adding or (update_fields and 'status' not in update_fields):
+        return
+    instance._old_status = sender.objects.filter(pk=instance.pk).values_list('status', flat=True).first()
+
 
 @receiver(post_save, sender=Order)
 def order_status_changed_handler(sender, instance, created, **kwargs):
@@ -19,56 +70,164 @@ def order_status_changed_handler(sender, instance, created, **kwargs):
     if update_fields and 'status' not in update_fields:
         return
 
+    # 状态未变化（例如只改了骑手、金额等字段）时不发送通知
+    old_status = getattr(instance, '_old_status', None)
+    if old_status == order.status:
+        return
+
+    notify_order_status(order)
+
+
+def notify_order_status(order):
+    """
+    按订单当前状态给顾客、商家、骑手发送通知。
+    QuerySet.update() 不触发 post_save，用条件 UPDATE 改状态的视图需手动调用。
+    """
     # --- 定义不同角色的通知 ---
-    
+    # 三类通知共用同一个链接，收集后一次性批量写入
+    link = _order_detail_link(order.pk)
+    notifs = []
+
+    # 只取接收者的外键 id，不实例化 Shop / Rider / User 对象
     # 1. 通知顾客
-    customer_message = None
-    if order.status == 'PAID':
-        customer_message = f"您的订单 #{order.pk} 已支付成功，商家正在备货。"
-    elif order.status == 'PREPARING':
-        customer_message = f"商家已接单，您的订单 #{order.pk} 正在备货中。"
-    elif order.status == 'READY_FOR_PICKUP':
-        customer_message = f"您的订单 #{order.pk} 已备货完成，等待骑手取货。"
-    elif order.status == 'DELIVERING':
-        customer_message = f"骑手已取货，您的订单 #{order.pk} 正在飞速向您奔来！"
-    elif order.status == 'DELIVERED':
-        customer_message = f"您的订单 #{order.pk} 已送达，欢迎再次光临！"
-    elif order.status == 'CANCELLED':
-        customer_message = f"很遗憾，您的订单 #{order.pk} 已被取消。"
-
-    if customer_message:
-        Notification.objects.create(
-            recipient=order.user,
-            message=customer_message,
-            link=reverse('shop:order_detail', kwargs={'pk': order.pk})
-        )
+    template = _CUSTOMER_TEMPLATES.get(order.status)
+    if template:
+        notifs.append(Notification(recipient_id=order.user_id, message=template.format(pk=order.pk), link=link))
 
     # 2. 通知商家
-    merchant_message = None
-    if order.status == 'PAID':
-        merchant_message = f"您有新的待处理订单 #{order.pk}，请尽快备货。"
-    
-    if merchant_message and order.shop.account:
-        Notification.objects.create(
-            recipient=order.shop.account,
-            message=merchant_message,
-            link=reverse('shop:order_detail', kwargs={'pk': order.pk})
-        )
+    template = _MERCHANT_TEMPLATES.get(order.status)
+    if template:
+        account_id = Shop.objects.filter(pk=order.shop_id).values_list('account_id', flat=True).first()
+        if account_id:
+            notifs.append(Notification(recipient_id=account_id, message=template.format(pk=order.pk), link=link))
 
-    # 3. 通知骑手 (如果订单分配了骑手)
-    rider_message = None
-    # 注意：这里我们假设骑手是在接单时（accept_order视图）被分配的，
-    # 那个时刻订单状态会从 PAID 变为 DELIVERING。
-    # 如果有其他状态需要通知骑手，也可以在这里添加。
-    
-    # 示例：如果订单被设置为“待取货”，可以通知所有骑手（实现较为复杂，暂不添加）
-    # 示例：如果订单被取消，而已有骑手接单，则通知骑手
-    if order.status == 'CANCELLED' and order.rider:
-        rider_message = f"订单 #{order.pk} 已被取消，您无需再进行配送。"
-        
-    if rider_message and order.rider:
-        Notification.objects.create(
-            recipient=order.rider.user,
-            message=rider_message,
-            link=reverse('shop:order_detail', kwargs={'pk': order.pk})
+    # 3. 通知骑手 (如果订单已被骑手接单)
+    template = _RIDER_TEMPLATES.get(order.status)
+    if template and order.rider_id:
+        rider_user_id = Rider.objects.filter(pk=order.rider_id).values_list('user_id', flat=True).first()
+        if rider_user_id:
+            notifs.append(Notification(recipient_id=rider_user_id, message=template.format(pk=order.pk), link=link))
+
+    if notifs:
+        Notification.objects.bulk_create(notifs)
+
+
+# ===== 店铺评分缓存 =====
+def _recompute_shop_rating(shop_id):
+    """按该店铺的全部评价重新计算 rating_avg / rating_count。"""
+    stats = Review.objects.filter(order__shop_id=shop_id).aggregate(avg=Avg('rating'), count=Count('id'))
+    Shop.objects.filter(pk=shop_id).update(rating_avg=stats['avg'] or 0, rating_count=stats['count'])
+
+
+def recompute_shop_ratings(shop_ids):
+    """bulk_create 不触发 post_save，批量导入评价后调用，重算相关店铺的评分。"""
+    for shop_id in set(shop_ids):
+        _recompute_shop_rating(shop_id)
+
+
+@receiver(post_save, sender=Review)
+def review_saved_handler(sender, instance, created, **kwargs):
+    """
+    新增评价时用一条 UPDATE 增量更新店铺的平均分，避免每次列表页都聚合全部评价。
+    """
+    shop_id = Order.objects.filter(pk=instance.order_id).values_list('shop_id', flat=True).first()
+    if shop_id is None:
+        return
+
+    if not created:
+        # 修改已有评价时无法增量推算，直接重算
+        _recompute_shop_rating(shop_id)
+        return
+
+    # 先转为浮点再相除，避免 SQLite 整数除法截断小数
+    Shop.objects.filter(pk=shop_id).update(
+        rating_avg=Cast(F('rating_avg') * F('rating_count') + instance.rating, FloatField()) / (F('rating_count') + 1),
+        rating_count=F('rating_count') + 1,
+    )
+
+
+@receiver(post_delete, sender=Review)
+def review_deleted_handler(sender, instance, **kwargs):
+    shop_id = Order.objects.filter(pk=instance.order_id).values_list('shop_id', flat=True).first()
+    if shop_id is not None:
+        _recompute_shop_rating(shop_id)
+
+
+# ===== 每日销售汇总 =====
+def _apply_sales_delta(order, sign):
+    """把订单金额按支付日期计入（sign=1）或移出（sign=-1）店铺的每日汇总。"""
+    if order.paid_at is None:
+        return
+    day = timezone.localtime(order.paid_at).date()
+    if sign > 0:
+        # 扣减时汇总行必然已存在；删除店铺级联删除订单时也不能再新建汇总行
+        DailySalesRollup.objects.get_or_create(shop_id=order.shop_id, date=day)
+    DailySalesRollup.objects.filter(shop_id=order.shop_id, date=day).update(
+        gross=F('gross') + sign * order.total,
+        orders=F('orders') + sign,
+    )
+
+
+def _apply_rider_income_delta(order, sign):
+    """把已送达订单的配送费按送达日期计入（sign=1）或移出（sign=-1）骑手的每日收入。"""
+    if order.rider_id is None or order.delivered_at is None:
+        return
+    day = timezone.localtime(order.delivered_at).date()
+    if sign > 0:
+        RiderDailyIncome.objects.get_or_create(rider_id=order.rider_id, date=day)
+    RiderDailyIncome.objects.filter(rider_id=order.rider_id, date=day).update(
+        income=F('income') + sign * order.delivery_fee,
+        orders=F('orders') + sign,
+    )
+
+
+def add_orders_to_rollups(orders):
+    """bulk_create 不触发 post_save，批量导入订单后调用，按 (店铺/骑手, 日期) 合并后计入每日汇总。"""
+    sales = defaultdict(lambda: [0, 0])
+    income = defaultdict(lambda: [0, 0])
+    for order in orders:
+        if order.status in Order.SALES_STATUSES and order.paid_at is not None:
+            row = sales[order.shop_id, timezone.localtime(order.paid_at).date()]
+            row[0] += order.total
+            row[1] += 1
+        if order.status == Order.Status.DELIVERED and order.rider_id is not None and order.delivered_at is not None:
+            row = income[order.rider_id, timezone.localtime(order.delivered_at).date()]
+            row[0] += order.delivery_fee
+            row[1] += 1
+    for (shop_id, day), (gross, count) in sales.items():
+        DailySalesRollup.objects.get_or_create(shop_id=shop_id, date=day)
+        DailySalesRollup.objects.filter(shop_id=shop_id, date=day).update(
+            gross=F('gross') + gross, orders=F('orders') + count,
         )
+    for (rider_id, day), (amount, count) in income.items():
+        RiderDailyIncome.objects.get_or_create(rider_id=rider_id, date=day)
+        RiderDailyIncome.objects.filter(rider_id=rider_id, date=day).update(
+            income=F('income') + amount, orders=F('orders') + count,
+        )
+
+
+@receiver(post_save, sender=Order)
+def order_sales_rollup_handler(sender, instance, created, **kwargs):
+    """订单进入或离开“已支付”状态集合、或送达状态变化时，增量更新每日汇总。"""
+    update_fields = kwargs.get('update_fields')
+    if not created and update_fields and 'status' not in update_fields:
+        return
+
+    old_status = getattr(instance, '_old_status', None)
+    was_counted = old_status in Order.SALES_STATUSES
+    is_counted = instance.status in Order.SALES_STATUSES
+    if was_counted != is_counted:
+        _apply_sales_delta(instance, 1 if is_counted else -1)
+
+    was_delivered = old_status == Order.Status.DELIVERED
+    is_delivered = instance.status == Order.Status.DELIVERED
+    if was_delivered != is_delivered:
+        _apply_rider_income_delta(instance, 1 if is_delivered else -1)
+
+
+@receiver(post_delete, sender=Order)
+def order_deleted_sales_handler(sender, instance, **kwargs):
+    if instance.status in Order.SALES_STATUSES:
+        _apply_sales_delta(instance, -1)
+    if instance.status == Order.Status.DELIVERED:
+        _apply_rider_income_delta(instance, -1)
@@ -1,3 +1,123 @@
+from datetime import date, datetime, timezone as dt_timezone
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import TestCase
+from django.urls import reverse
+
+from .models import DailySalesRollup, Order, Product, Rider, RiderDailyIncome, Shop
+
+
+class RollupSignalTests(TestCase):
+    """每日销售汇总 / 骑手每日收入由订单信号和 add_orders_to_rollups 增量维护。"""
+
+    # 2024-05-01 12:00 UTC 即上海时间 2024-05-01 20:00
+    PAID_AT = datetime(2024, 5, 1, 12, 0, tzinfo=dt_timezone.utc)
+    DAY = date(2024, 5, 1)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user('customer', password='x')
+        cls.merchant = User.objects.create_user('merchant', password='x')
+        cls.rider = Rider.objects.create(user=User.objects.create_user('rider', password='x'))
+        cls.shop = Shop.objects.create(name='测试店铺', account=cls.merchant)
+
+    def create_order(self, **fields):
+        fields = {'subtotal': Decimal('20.00'), 'delivery_fee': Decimal('3.00'), 'total': Decimal('23.00'), **fields}
+        return Order.objects.create(user=self.customer, shop=self.shop, **fields)
+
+    def sales(self, day):
+        return DailySalesRollup.objects.filter(shop=self.shop, date=day).values_list('gross', 'orders').first()
+
+    def income(self, day):
+        return RiderDailyIncome.objects.filter(rider=self.rider, date=day).values_list('income', 'orders').first()
+
+    def test_pay_cancel_repay(self):
+        order = self.create_order()
+        self.assertIsNone(self.sales(self.DAY))
+
+        order.transition_to(Order.Status.PAID, paid_at=self.PAID_AT)
+        self.assertEqual(self.sales(self.DAY), (Decimal('23.00'), 1))
+
+        order.transition_to(Order.Status.CANCELLED)
+        self.assertEqual(self.sales(self.DAY), (Decimal('0.00'), 0))
+
+        order.transition_to(Order.Status.PAID, paid_at=self.PAID_AT)
+        self.assertEqual(self.sales(self.DAY), (Decimal('23.00'), 1))
+
+    def test_status_change_within_sales_statuses_is_not_counted_twice(self):
+        order = self.create_order()
+        order.transition_to(Order.Status.PAID, paid_at=self.PAID_AT)
+        order.transition_to(Order.Status.PREPARING)
+        self.assertEqual(self.sales(self.DAY), (Decimal('23.00'), 1))
+
+    def test_deliver_then_delete(self):
+        order = self.create_order()
+        order.transition_to(Order.Status.PAID, paid_at=self.PAID_AT)
+        order.transition_to(Order.Status.DELIVERING, rider=self.rider, accepted_at=self.PAID_AT)
+        self.assertIsNone(self.income(self.DAY))
+
+        order.transition_to(Order.Status.DELIVERED, delivered_at=self.PAID_AT)
+        self.assertEqual(self.income(self.DAY), (Decimal('3.00'), 1))
+        self.assertEqual(self.sales(self.DAY), (Decimal('23.00'), 1))
+
+        order.delete()
+        self.assertEqual(self.income(self.DAY), (Decimal('0.00'), 0))
+        self.assertEqual(self.sales(self.DAY), (Decimal('0.00'), 0))
+
+    def test_paid_after_1600_utc_counts_on_next_local_day(self):
+        order = self.create_order()
+        late = datetime(2024, 5, 1, 16, 30, tzinfo=dt_timezone.utc)  # 上海时间 5 月 2 日 00:30
+        order.transition_to(Order.Status.PAID, paid_at=late)
+        order.transition_to(Order.Status.DELIVERING, rider=self.rider, accepted_at=late)
+        order.transition_to(Order.Status.DELIVERED, delivered_at=late)
+
+        next_day = date(2024, 5, 2)
+        self.assertIsNone(self.sales(self.DAY))
+        self.assertEqual(self.sales(next_day), (Decimal('23.00'), 1))
+        self.assertIsNone(self.income(self.DAY))
+        self.assertEqual(self.income(next_day), (Decimal('3.00'), 1))
+
+    def test_order_import_adds_to_rollups(self):
+        Product.objects.create(shop=self.shop, name='奶茶', sku='TEA-1', price=Decimal('10.00'), stock=100)
+        admin = User.objects.create_superuser('admin', password='x')
+        self.client.force_login(admin)
+        self.create_order().transition_to(Order.Status.PAID, paid_at=self.PAID_AT)  # 已有的一单
+
+        header = 'user_username,shop_name,contact_name,contact_phone,address_line_1,city,postal_code,items,delivery_fee,status,paid_at\n'
+        row = 'customer,测试店铺,张三,123,路1号,上海,200000,"[{{""sku"": ""TEA-1"", ""quantity"": 2}}]",2.00,{status},{paid_at}\n'
+        content = header + ''.join([
+            row.format(status='DELIVERED', paid_at='2024-05-01 10:00:00'),  # 本地时间，计入 5 月 1 日
+            row.format(status='PAID', paid_at='2024-05-01T16:30:00+00:00'),  # 上海时间 5 月 2 日
+            row.format(status='CANCELLED', paid_at='2024-05-01 11:00:00'),  # 不计入销售额
+        ])
+        response = self.client.post(reverse('shop:order_import'), {
+            'csv_file': SimpleUploadedFile('orders.csv', content.encode('utf-8')),
+        })
+
+        self.assertRedirects(response, reverse('shop:order_list'), fetch_redirect_response=False)
+        self.assertEqual(Order.objects.count(), 4)
+        self.assertEqual(self.sales(self.DAY), (Decimal('45.00'), 2))
+        self.assertEqual(self.sales(date(2024, 5, 2)), (Decimal('22.00'), 1))
+        # 导入的订单没有骑手，不计入骑手收入
+        self.assertFalse(RiderDailyIncome.objects.exists())
+
+
+class OrderPayTests(TestCase):
+    def test_pay_deducts_stock_and_touches_updated_at(self):
+        customer = User.objects.create_user('customer', password='x')
+        shop = Shop.objects.create(name='测试店铺', account=User.objects.create_user('merchant', password='x'))
+        product = Product.objects.create(shop=shop, name='奶茶', sku='TEA-1', price=Decimal('10.00'), stock=5)
+        Product.objects.filter(pk=product.pk).update(updated_at=datetime(2024, 1, 1, tzinfo=dt_timezone.utc))
+        order = Order.objects.create(user=customer, shop=shop, subtotal=Decimal('20.00'), total=Decimal('21.00'))
+        order.items.create(product=product, quantity=2, unit_price=product.price)
+
+        self.client.force_login(customer)
+        self.client.post(reverse('shop:order_pay', args=[order.pk]))
 
-# Create your tests here.
+        product.refresh_from_db()
+        order.refresh_from_db()
+        self.assertEqual(order.status, Order.Status.PAID)
+        self.assertEqual(product.stock, 3)
+        self.assertEqual(product.updated_at, order.paid_at)
@@ -4,7 +4,7 @@ from django.urls import reverse
 from .models import (
     Shop, Product, ProductCategory, Order, OrderItem, Rider, Address, 
     Banner, Review, SupportTicket, UserProfile, Coupon, Favorite,
-    Notification
+    Notification, DailySalesRollup, RiderDailyIncome
 )
 from .forms import (
     ProductForm, RegistrationForm, ProductCategoryForm, AddressForm, 
@@ -13,29 +13,83 @@ from .forms import (
 from django.contrib.auth.decorators import user_passes_test, login_required
 from django.contrib.auth.models import User
 from django.contrib.auth import login, update_session_auth_hash
-from django.db import transaction
+from django.contrib.auth.hashers import make_password
+from django.db import IntegrityError, transaction
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
 from django.utils import timezone
-from django.db.models import Sum, Count, F, Prefetch
-from django.db.models.functions import TruncDate
-from django.http import JsonResponse
+from django.db.models import Sum, Count, F, Q, Prefetch, Case, When, Value, BooleanField, DecimalField, Subquery, OuterRef, Exists
+from django.http import Http404, StreamingHttpResponse
 from decimal import Decimal, InvalidOperation
 from django.views.decorators.http import require_POST
 import json
-from .ai_service import process_ai_conversation
-from datetime import date, timedelta
+from .ai_service import stream_ai_conversation, AI_ERROR_PREFIX
+from .json_utils import json_response, loads as json_loads
+from .signals import add_orders_to_rollups, notify_order_status, recompute_shop_ratings
+from datetime import datetime, time, timedelta
+import codecs
+import os
 import csv
-import io
 import random
+from itertools import chain
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 # ===== Helper Functions =====
-def get_cart_summary(session):
-    """Computes all cart details and returns them in a dictionary."""
+def local_day_start(day):
+    """本地日期 0 点对应的带时区时间；按 paid_at 原始列做范围过滤才能用上索引（__date 需要函数索引）。"""
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+def parse_import_datetime(value):
+    """解析导入文件中的时间，按订单时间字段的规则解析；无时区的时间视为本地时间。"""
+    value = Order._meta.get_field('paid_at').to_python(value.strip()) if value and value.strip() else None
+    if value is not None and timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    return value
+
+def cart_total(cart):
+    """按商品当前价格，用一条聚合查询算出购物车总价（不信任会话中缓存的价格）。"""
+    if not cart:
+        return Decimal('0.00')
+    whens = [When(pk=int(pid), then=F('price') * Value(item['quantity'])) for pid, item in cart.items()]
+    total = Product.objects.filter(pk__in=[int(pid) for pid in cart]).aggregate(
+        total=Sum(Case(*whens, output_field=DecimalField(max_digits=12, decimal_places=2)))
+    )['total']
+    return (total or Decimal('0')).quantize(Decimal('0.01'))
+
+# 加入购物车只需要这些列，店铺名随商品一起取回
+CART_PRODUCTS = Product.objects.select_related('shop').only('id', 'name', 'price', 'shop__name')
+
+def start_cart(session, shop):
+    """购物车为空时记下所属店铺；店铺名一并存入会话，之后提示冲突时无需再查询。"""
+    session['cart_shop_id'] = shop.pk
+    session['cart_shop_name'] = shop.name
+
+def cart_shop_name(session):
+    name = session.get('cart_shop_name')
+    if name is None:  # 旧会话中没有店铺名
+        name = Shop.objects.filter(pk=session.get('cart_shop_id')).values_list('name', flat=True).first()
+    return name
+
+# 应用优惠券时只用到这些列
+CART_COUPONS = Coupon.objects.only('id', 'code', 'discount_amount', 'min_purchase_amount')
+
+def get_session_coupon(request):
+    """会话中当前使用的优惠券，同一请求内只查询一次。"""
+    if not hasattr(request, '_coupon'):
+        coupon_id = request.session.get('coupon_id')
+        request._coupon = Coupon.objects.filter(pk=coupon_id).first() if coupon_id else None
+    return request._coupon
+
+def get_cart_summary(session, coupon=None, total_price=None):
+    """Computes all cart details and returns them in a dictionary.
+
+    调用方已取得当前优惠券或已算出总价时可通过 coupon / total_price 传入，避免重复查询。
+    """
     cart = session.get('cart', {})
-    total_price = Decimal('0.00')
-    total_items = 0
-    for pid, item in cart.items():
-        total_price += Decimal(item['price']) * item['quantity']
-        total_items += item['quantity']
+    if total_price is None:
+        total_price = cart_total(cart)
+    total_items = sum(item['quantity'] for item in cart.values())
 
     summary = {
         'total_price': f'{total_price:.2f}',
@@ -48,7 +102,8 @@ def get_cart_summary(session):
     coupon_id = session.get('coupon_id')
     if coupon_id:
         try:
-            coupon = Coupon.objects.get(id=coupon_id)
+            if coupon is None or coupon.pk != coupon_id:
+                coupon = Coupon.objects.get(id=coupon_id)
             discount = coupon.discount_amount
             final_price = total_price - discount
             summary.update({
@@ -63,7 +118,16 @@ def get_cart_summary(session):
 
 # ===== 核心页面 =====
 def shop_list(request):
-    shops = Shop.objects.prefetch_related(Prefetch('products', queryset=Product.objects.filter(is_active=True).order_by('-created_at')[:4], to_attr='recent_products'))
+    # “新店”标记由数据库一次算出，模板不再逐个店铺计算时间差
+    new_since = timezone.now() - timedelta(days=7)
+    shops = Shop.objects.annotate(
+        is_new=Case(When(created_at__gt=new_since, then=Value(True)), default=Value(False), output_field=BooleanField())
+    ).prefetch_related(Prefetch(
+        'products',
+        # 缩略图只用到名称和图片
+        queryset=Product.objects.filter(is_active=True).only('id', 'shop_id', 'name', 'image', 'created_at').order_by('-created_at')[:4],
+        to_attr='recent_products',
+    ))
     banners = Banner.objects.filter(is_active=True)
     return render(request, 'shop/shop_list.html', {'shops': shops, 'banners': banners})
 
@@ -71,30 +135,34 @@ def search(request):
     query = request.GET.get('q')
     if not query:
         return redirect('shop:shop_list')
-    shops = Shop.objects.filter(name__icontains=query)
-    products = Product.objects.filter(name__icontains=query, is_active=True)
+    # icontains 在 PostgreSQL 上可命中 UPPER(name) 的 trigram 索引（见迁移 0017）
+    shops = Shop.objects.filter(name__icontains=query).only('id', 'name')
+    products = Product.objects.filter(name__icontains=query, is_active=True).only('id', 'name', 'price', 'image')
     return render(request, 'shop/search_results.html', {'query': query, 'shops': shops, 'products': products})
 
 def shop_detail(request, pk):
     shop = get_object_or_404(Shop, pk=pk)
-    products = shop.products.filter(is_active=True)
-    categories = shop.categories.all()
+    products = shop.products.filter(is_active=True).select_related('category')
+    categories = list(shop.categories.all())
     return render(request, 'shop/shop_detail.html', {'shop': shop, 'products': products, 'categories': categories})
 
 def product_list(request):
     if is_merchant(request.user):
-        products = Product.objects.filter(shop=request.user.shop_account)
+        products = Product.objects.filter(shop=request.user.shop_account).select_related('shop')
     else:
-        products = Product.objects.filter(is_active=True)
+        products = Product.objects.filter(is_active=True).select_related('shop')
     return render(request, 'shop/product_list.html', {'products': products})
 
 def product_detail(request, pk):
-    product = get_object_or_404(Product, pk=pk)
+    product = get_object_or_404(Product.objects.select_related('shop'), pk=pk)
     is_owner = is_merchant(request.user) and product.shop == request.user.shop_account
     if not product.is_active and not is_owner:
         messages.error(request, "该商品已下架。")
         return redirect('shop:product_list')
-    reviews = Review.objects.filter(order__items__product=product).distinct()
+    # EXISTS 子查询代替 JOIN + DISTINCT，同一订单里有多件该商品也不会产生重复行
+    reviews = Review.objects.filter(
+        Exists(OrderItem.objects.filter(order=OuterRef('order'), product=product))
+    ).select_related('user')
     
     is_favorited = False
     if request.user.is_authenticated:
@@ -125,23 +193,23 @@ def superuser_required(view_func):
 # ===== API Views (for AJAX) =====
 def cart_state_api(request):
     """Returns the current state of the cart."""
-    return JsonResponse(get_cart_summary(request.session))
+    return json_response(get_cart_summary(request.session))
 
 @require_POST
 def add_to_cart_api(request):
     try:
-        data = json.loads(request.body)
+        data = json_loads(request.body)
         product_id = data.get('product_id')
-        product = get_object_or_404(Product, pk=product_id)
+        product = get_object_or_404(CART_PRODUCTS, pk=product_id)
         
         cart = request.session.get('cart', {})
         cart_shop_id = request.session.get('cart_shop_id')
 
-        if cart and cart_shop_id != product.shop.id:
-            return JsonResponse({'success': False, 'message': f"购物车中已有来自 ‘{Shop.objects.get(pk=cart_shop_id).name}’ 的商品，请先清空购物车再添加。"})
+        if cart and cart_shop_id != product.shop_id:
+            return json_response({'success': False, 'message': f"购物车中已有来自 ‘{cart_shop_name(request.session)}’ 的商品，请先清空购物车再添加。"})
         
         if not cart:
-            request.session['cart_shop_id'] = product.shop.id
+            start_cart(request.session, product.shop)
             request.session['coupon_id'] = None
 
         pid_str = str(product_id)
@@ -151,14 +219,14 @@ def add_to_cart_api(request):
             cart[pid_str] = {'name': product.name, 'price': str(product.price), 'quantity': 1}
         
         request.session['cart'] = cart
-        return JsonResponse({'success': True, 'message': f"已将 {product.name} 添加到购物车。", 'cart': get_cart_summary(request.session)})
+        return json_response({'success': True, 'message': f"已将 {product.name} 添加到购物车。", 'cart': get_cart_summary(request.session)})
     except Exception as e:
-        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+        return json_response({'success': False, 'message': str(e)}, status=400)
 
 @require_POST
 def update_cart_item_api(request):
     try:
-        data = json.loads(request.body)
+        data = json_loads(request.body)
         item_id = str(data.get('item_id'))
         quantity = int(data.get('quantity'))
         
@@ -171,16 +239,17 @@ def update_cart_item_api(request):
             request.session['cart'] = cart
             if not cart:
                 request.session.pop('cart_shop_id', None)
+                request.session.pop('cart_shop_name', None)
                 request.session.pop('coupon_id', None)
-            return JsonResponse({'success': True, 'cart': get_cart_summary(request.session)})
-        return JsonResponse({'success': False, 'message': '商品未找到'}, status=404)
+            return json_response({'success': True, 'cart': get_cart_summary(request.session)})
+        return json_response({'success': False, 'message': '商品未找到'}, status=404)
     except Exception as e:
-        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+        return json_response({'success': False, 'message': str(e)}, status=400)
 
 @require_POST
 def remove_cart_item_api(request):
     try:
-        data = json.loads(request.body)
+        data = json_loads(request.body)
         item_id = str(data.get('item_id'))
         cart = request.session.get('cart', {})
         if item_id in cart:
@@ -188,39 +257,40 @@ def remove_cart_item_api(request):
             request.session['cart'] = cart
             if not cart:
                 request.session.pop('cart_shop_id', None)
+                request.session.pop('cart_shop_name', None)
                 request.session.pop('coupon_id', None)
-            return JsonResponse({'success': True, 'cart': get_cart_summary(request.session)})
-        return JsonResponse({'success': False, 'message': '商品未找到'}, status=404)
+            return json_response({'success': True, 'cart': get_cart_summary(request.session)})
+        return json_response({'success': False, 'message': '商品未找到'}, status=404)
     except Exception as e:
-        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+        return json_response({'success': False, 'message': str(e)}, status=400)
 
 @require_POST
 def apply_coupon_api(request):
     try:
-        data = json.loads(request.body)
+        data = json_loads(request.body)
         code = data.get('coupon_code')
         shop_id = request.session.get('cart_shop_id')
         cart = request.session.get('cart', {})
 
         if not code:
-            return JsonResponse({'success': False, 'message': '请输入优惠码。'})
+            return json_response({'success': False, 'message': '请输入优惠码。'})
         if not shop_id:
-            return JsonResponse({'success': False, 'message': '购物车为空，无法使用优惠券。'})
+            return json_response({'success': False, 'message': '购物车为空，无法使用优惠券。'})
 
         now = timezone.now()
         try:
-            coupon = Coupon.objects.get(code__iexact=code, shop_id=shop_id, is_active=True, valid_from__lte=now, valid_to__gte=now)
-            total_price = sum(Decimal(item['price']) * item['quantity'] for item in cart.values())
+            coupon = CART_COUPONS.get(code__iexact=code, shop_id=shop_id, is_active=True, valid_from__lte=now, valid_to__gte=now)
+            total_price = cart_total(cart)
             if total_price < coupon.min_purchase_amount:
-                return JsonResponse({'success': False, 'message': f"订单金额未达到 ¥{coupon.min_purchase_amount} 的最低消费要求。"})
+                return json_response({'success': False, 'message': f"订单金额未达到 ¥{coupon.min_purchase_amount} 的最低消费要求。"})
 
             request.session['coupon_id'] = coupon.id
-            return JsonResponse({'success': True, 'message': f"已成功应用优惠券 '{coupon.code}'！", 'cart': get_cart_summary(request.session)})
+            return json_response({'success': True, 'message': f"已成功应用优惠券 '{coupon.code}'！", 'cart': get_cart_summary(request.session, coupon=coupon, total_price=total_price)})
         except Coupon.DoesNotExist:
             request.session['coupon_id'] = None
-            return JsonResponse({'success': False, 'message': '无效或已过期的优惠券。'})
+            return json_response({'success': False, 'message': '无效或已过期的优惠券。'})
     except Exception as e:
-        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+        return json_response({'success': False, 'message': str(e)}, status=400)
 
 @login_required
 @require_POST
@@ -231,33 +301,34 @@ def chatbot_api(request):
         profile.reset_tokens_if_needed()
         DAILY_TOKEN_LIMIT = 100000 
         if profile.ai_tokens_used >= DAILY_TOKEN_LIMIT:
-            return JsonResponse({'error': "抱歉，您今日的AI对话额度已用完，请明天再来。"}, status=429)
+            return json_response({'error': "抱歉，您今日的AI对话额度已用完，请明天再来。"}, status=429)
 
         # 解析请求
-        data = json.loads(request.body)
+        data = json_loads(request.body)
         user_question = data.get('question')
         if not user_question:
-            return JsonResponse({'error': '问题不能为空。'}, status=400)
+            return json_response({'error': '问题不能为空。'}, status=400)
 
-        # 调用AI服务（非流式）
+        # 调用AI服务（流式）：收到一段就发给浏览器一段，不在内存中拼接完整回答
         conversation = [{"role": "user", "content": user_question}]
-        response_generator = process_ai_conversation(conversation)
-        
-        # 将生成器的所有内容拼接成一个完整的字符串
-        full_response = "".join(response_generator)
+        chunks = stream_ai_conversation(conversation)
 
-        # 检查在AI服务内部是否发生了错误
-        if full_response.startswith("请求AI服务时出错:") or "处理请求时发生意外错误" in full_response:
-             return JsonResponse({'error': full_response}, status=500)
+        # 先取第一段：配置缺失、连接失败等错误此时即可发现，仍按原来的 JSON 错误返回。
+        # 只检查这一段的前缀，之后的内容原样转发，不再扫描
+        first_chunk = next(chunks, '')
+        if first_chunk.startswith(AI_ERROR_PREFIX):
+            return json_response({'error': first_chunk}, status=500)
 
-        # 成功，返回完整响应
-        return JsonResponse({'response': full_response})
+        response = StreamingHttpResponse(chain((first_chunk,), chunks), content_type='text/plain; charset=utf-8')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # 禁止 Nginx 缓冲整段响应
+        return response
 
     except json.JSONDecodeError:
-        return JsonResponse({'error': '无效的JSON格式。'}, status=400)
+        return json_response({'error': '无效的JSON格式。'}, status=400)
     except Exception as e:
         # 捕获所有其他异常
-        return JsonResponse({'error': f'处理请求时发生意外错误: {str(e)}'}, status=500)
+        return json_response({'error': f'处理请求时发生意外错误: {str(e)}'}, status=500)
 
 @merchant_required
 def sales_chart_data(request):
@@ -265,23 +336,18 @@ def sales_chart_data(request):
     period = request.GET.get('period', '7days')
     
     if period == '30days':
-        start_date = timezone.now().date() - timedelta(days=30)
+        start_date = timezone.localdate() - timedelta(days=30)
     else: # default to 7days
-        start_date = timezone.now().date() - timedelta(days=7)
+        start_date = timezone.localdate() - timedelta(days=7)
 
-    sales_data = Order.objects.filter(
-        shop=shop, 
-        paid_at__date__gte=start_date,
-        status__in=['PAID', 'PREPARING', 'READY_FOR_PICKUP', 'DELIVERING', 'DELIVERED']
-    ).annotate(
-        day=TruncDate('paid_at')
-    ).values('day').annotate(
-        daily_sales=Sum('total')
-    ).order_by('day')
+    # 每日销售额直接读取预先汇总的数据
+    sales_data = DailySalesRollup.objects.filter(
+        shop=shop, date__gte=start_date, orders__gt=0
+    ).values('date', 'gross').order_by('date')
 
     top_products_data = OrderItem.objects.filter(
         order__shop=shop,
-        order__paid_at__date__gte=start_date,
+        order__paid_at__gte=local_day_start(start_date),
         order__status__in=['PAID', 'PREPARING', 'READY_FOR_PICKUP', 'DELIVERING', 'DELIVERED']
     ).values('product__name').annotate(
         total_sold=Sum('quantity')
@@ -289,15 +355,15 @@ def sales_chart_data(request):
 
     data = {
         'sales_trend': {
-            'labels': [d['day'].isoformat() if hasattr(d['day'], 'isoformat') else str(d['day']) for d in sales_data],
-            'data': [float(d['daily_sales']) for d in sales_data],
+            'labels': [d['date'].isoformat() for d in sales_data],
+            'data': [float(d['gross']) for d in sales_data],
         },
         'top_products': {
             'labels': [p['product__name'] for p in top_products_data],
             'data': [p['total_sold'] for p in top_products_data],
         }
     }
-    return JsonResponse(data)
+    return json_response(data)
 
 @rider_required
 def rider_income_data(request):
@@ -305,27 +371,22 @@ def rider_income_data(request):
     period = request.GET.get('period', '7days')
     
     if period == '30days':
-        start_date = timezone.now().date() - timedelta(days=30)
+        start_date = timezone.localdate() - timedelta(days=30)
     else: # default to 7days
-        start_date = timezone.now().date() - timedelta(days=7)
+        start_date = timezone.localdate() - timedelta(days=7)
 
-    income_data = Order.objects.filter(
-        rider=rider, 
-        delivered_at__date__gte=start_date,
-        status='DELIVERED'
-    ).annotate(
-        day=TruncDate('delivered_at')
-    ).values('day').annotate(
-        daily_income=Sum('delivery_fee')
-    ).order_by('day')
+    # 每日收入直接读取预先汇总的数据
+    income_data = RiderDailyIncome.objects.filter(
+        rider=rider, date__gte=start_date, orders__gt=0
+    ).values('date', 'income').order_by('date')
 
     data = {
         'income_trend': {
-            'labels': [d['day'].isoformat() if hasattr(d['day'], 'isoformat') else str(d['day']) for d in income_data],
-            'data': [float(d['daily_income']) for d in income_data],
+            'labels': [d['date'].isoformat() for d in income_data],
+            'data': [float(d['income']) for d in income_data],
         }
     }
-    return JsonResponse(data)
+    return json_response(data)
 
 # ===== Page Rendering Views =====
 
@@ -333,20 +394,31 @@ def rider_income_data(request):
 def cart_detail(request):
     cart = request.session.get('cart', {})
     product_ids = [int(pid) for pid in cart.keys()]
-    products = Product.objects.in_bulk(product_ids)
-    
+    # 只取展示需要的列：当前价格和店铺名，一条 JOIN 查询
+    products = {
+        pk: (price, shop_name)
+        for pk, price, shop_name in Product.objects.filter(pk__in=product_ids).values_list('pk', 'price', 'shop__name')
+    }
+
+    # 展示用的副本按商品当前价格计算小计，不改动会话中的数据
+    display_cart = {}
     for pid, item in cart.items():
+        item = dict(item)
         product = products.get(int(pid))
         if product:
-            item['shop_name'] = product.shop.name
-            item['subtotal'] = Decimal(item['price']) * item['quantity']
-
-    summary = get_cart_summary(request.session)
-    context = {'cart': cart, **summary}
+            price, shop_name = product
+            item['price'] = price
+            item['shop_name'] = shop_name
+            item['subtotal'] = price * item['quantity']
+        display_cart[pid] = item
+
+    coupon = get_session_coupon(request)
+    summary = get_cart_summary(request.session, coupon=coupon)
+    context = {'cart': display_cart, **summary}
     # The 'total_price', 'coupon', 'discount', 'final_price' are now coming from the summary
     context['total_price'] = Decimal(summary['total_price'])
     if summary['coupon']:
-        context['coupon'] = Coupon.objects.get(code=summary['coupon']['code'])
+        context['coupon'] = coupon
         context['discount'] = Decimal(summary['discount'])
         context['final_price'] = Decimal(summary['final_price'])
     
@@ -356,15 +428,61 @@ def cart_detail(request):
 @merchant_required
 def merchant_dashboard(request):
     shop = request.user.shop_account
-    today = date.today()
-    today_sales = Order.objects.filter(shop=shop, paid_at__date=today, status__in=['PAID', 'PREPARING', 'READY_FOR_PICKUP', 'DELIVERING', 'DELIVERED']).aggregate(total_sales=Sum('total'))['total_sales'] or 0
-    pending_orders_count = Order.objects.filter(shop=shop, status__in=['PAID', 'PREPARING']).count()
+    today = timezone.localdate()
+    # 今日销售额与待处理订单数作为两个标量子查询，一次往返取回
+    stats = Shop.objects.filter(pk=shop.pk).values(
+        today_sales=Subquery(
+            DailySalesRollup.objects.filter(shop=OuterRef('pk'), date=today).values('gross')[:1]
+        ),
+        pending_orders_count=Subquery(
+            Order.objects.filter(shop=OuterRef('pk'), status__in=['PAID', 'PREPARING'])
+            .order_by().values('shop').annotate(n=Count('pk')).values('n')
+        ),
+    ).get()
     return render(request, 'shop/merchant_dashboard.html', {
         'shop': shop,
-        'today_sales': today_sales,
-        'pending_orders_count': pending_orders_count,
+        'today_sales': stats['today_sales'] or 0,
+        'pending_orders_count': stats['pending_orders_count'] or 0,
     })
 
+PRODUCT_IMPORT_BATCH_SIZE = 1000
+
+def _import_product_rows(shop, rows):
+    """写入一批已解析的商品行，返回 (新建数, 更新数)。"""
+    # 分类：一次批量创建缺失的，再一次查询取回全部
+    category_names = {category_name for _, category_name, _ in rows if category_name}
+    if category_names:
+        ProductCategory.objects.bulk_create(
+            [ProductCategory(shop=shop, name=n) for n in category_names], ignore_conflicts=True
+        )
+    categories = {c.name: c for c in ProductCategory.objects.filter(shop=shop, name__in=category_names)}
+
+    # 只取本批中出现的 SKU
+    existing_skus = Product.objects.filter(shop=shop, sku__in=[sku for sku, _, _ in rows]).in_bulk(field_name='sku')
+
+    products_to_create = []
+    products_to_update = {}
+    for sku, category_name, product_data in rows:
+        product_data['category'] = categories.get(category_name)
+        # Use SKU to check for existing product
+        existing_product = existing_skus.get(sku)
+        if existing_product:
+            # Update existing product (文件中重复的 SKU 以最后一行为准)
+            for key, value in product_data.items():
+                setattr(existing_product, key, value)
+            if existing_product.pk:
+                products_to_update[sku] = existing_product
+        else:
+            # Create new product
+            existing_skus[sku] = Product(sku=sku, **product_data)
+            products_to_create.append(existing_skus[sku])
+
+    Product.objects.bulk_create(products_to_create, batch_size=PRODUCT_IMPORT_BATCH_SIZE)
+    # Define fields to be updated
+    update_fields = ['name', 'description', 'price', 'category', 'stock', 'is_active']
+    Product.objects.bulk_update(products_to_update.values(), update_fields, batch_size=PRODUCT_IMPORT_BATCH_SIZE)
+    return len(products_to_create), len(products_to_update)
+
 @merchant_required
 def product_import(request):
     if request.method == 'POST':
@@ -378,85 +496,76 @@ def product_import(request):
             return redirect('shop:product_import')
 
         try:
-            decoded_file = csv_file.read().decode('utf-8-sig')
-            io_string = io.StringIO(decoded_file)
-            reader = csv.DictReader(io_string)
+            # 按行流式解码，不把整个文件读入内存
+            reader = csv.DictReader(codecs.iterdecode(csv_file, 'utf-8-sig'))
             
             shop = request.user.shop_account
-            products_to_create = []
-            products_to_update = []
+            rows = []
             errors = []
-            
-            # Get all existing SKUs in the shop for faster lookup
-            existing_skus = {p.sku: p for p in Product.objects.filter(shop=shop)}
+            created_count = updated_count = 0
 
-            for i, row in enumerate(reader):
-                line_num = i + 2
-                try:
-                    sku = row.get('sku', '').strip()
-                    if not sku:
-                        errors.append(f"第 {line_num} 行: 'sku' 字段不能为空。")
-                        continue
+            with transaction.atomic():
+                for i, row in enumerate(reader):
+                    line_num = i + 2
+                    try:
+                        sku = row.get('sku', '').strip()
+                        if not sku:
+                            errors.append(f"第 {line_num} 行: 'sku' 字段不能为空。")
+                            continue
 
-                    name = row.get('name', '').strip()
-                    if not name:
-                        errors.append(f"第 {line_num} 行: 'name' 字段不能为空。")
-                        continue
+                        name = row.get('name', '').strip()
+                        if not name:
+                            errors.append(f"第 {line_num} 行: 'name' 字段不能为空。")
+                            continue
+                            
+                        price_str = row.get('price', '0').strip()
+                        price = Decimal(price_str)
                         
-                    price_str = row.get('price', '0').strip()
-                    price = Decimal(price_str)
-                    
-                    stock_str = row.get('stock', '0').strip()
-                    stock = int(stock_str)
+                        stock_str = row.get('stock', '0').strip()
+                        stock = int(stock_str)
 
-                    category_name = row.get('category', '').strip()
-                    category = None
-                    if category_name:
-                        category, _ = ProductCategory.objects.get_or_create(name=category_name, shop=shop)
+                        is_active = row.get('is_active', 'true').strip().lower() in ['true', '1', 'yes']
+                        
+                        rows.append((sku, row.get('category', '').strip(), {
+                            'name': name,
+                            'description': row.get('description', '').strip(),
+                            'price': price,
+                            'stock': stock,
+                            'is_active': is_active,
+                            'shop': shop
+                        }))
+
+                    except (ValueError, TypeError, InvalidOperation) as e:
+                        errors.append(f"第 {line_num} 行: 数据格式错误 - {e}")
+                    except Exception as e:
+                        errors.append(f"第 {line_num} 行: 处理时发生未知错误 - {e}")
 
-                    is_active = row.get('is_active', 'true').strip().lower() in ['true', '1', 'yes']
-                    
-                    product_data = {
-                        'name': name,
-                        'description': row.get('description', '').strip(),
-                        'price': price,
-                        'category': category,
-                        'stock': stock,
-                        'is_active': is_active,
-                        'shop': shop
-                    }
-
-                    # Use SKU to check for existing product
-                    existing_product = existing_skus.get(sku)
-                    if existing_product:
-                        # Update existing product
-                        for key, value in product_data.items():
-                            setattr(existing_product, key, value)
-                        products_to_update.append(existing_product)
-                    else:
-                        # Create new product
-                        product_data['sku'] = sku
-                        products_to_create.append(Product(**product_data))
-
-                except (ValueError, TypeError, InvalidOperation) as e:
-                    errors.append(f"第 {line_num} 行: 数据格式错误 - {e}")
-                except Exception as e:
-                    errors.append(f"第 {line_num} 行: 处理时发生未知错误 - {e}")
+                    # 每攒够一批就写入；出现错误后只继续校验，不再写入
+                    if len(rows) >= PRODUCT_IMPORT_BATCH_SIZE:
+                        if not errors:
+                            created, updated = _import_product_rows(shop, rows)
+                            created_count += created
+                            updated_count += updated
+                        rows = []
+
+                if rows and not errors:
+                    created, updated = _import_product_rows(shop, rows)
+                    created_count += created
+                    updated_count += updated
+
+                if errors:
+                    # 任何一行有错都不导入，已写入的批次一并回滚
+                    transaction.set_rollback(True)
 
             if errors:
                 for error in errors:
                     messages.error(request, error)
             else:
-                with transaction.atomic():
-                    if products_to_create:
-                        Product.objects.bulk_create(products_to_create)
-                        messages.success(request, f"成功创建 {len(products_to_create)} 个新商品。")
-                    if products_to_update:
-                        # Define fields to be updated
-                        update_fields = ['name', 'description', 'price', 'category', 'stock', 'is_active']
-                        Product.objects.bulk_update(products_to_update, update_fields)
-                        messages.success(request, f"成功更新 {len(products_to_update)} 个现有商品。")
-                if not products_to_create and not products_to_update:
+                if created_count:
+                    messages.success(request, f"成功创建 {created_count} 个新商品。")
+                if updated_count:
+                    messages.success(request, f"成功更新 {updated_count} 个现有商品。")
+                if not created_count and not updated_count:
                      messages.info(request, "CSV文件中没有需要导入或更新的商品数据。")
                 return redirect('shop:product_list')
 
@@ -488,21 +597,26 @@ def product_image_batch_update(request):
             return redirect('shop:product_image_batch_update')
 
         try:
-            with transaction.atomic():
-                if len(images) == 1:
-                    # 一张图，覆盖所有选定商品
-                    image_file = images[0]
-                    for product in products_to_update:
-                        product.image.save(image_file.name, image_file, save=True)
-                        image_file.seek(0) # 重置文件指针以便下次使用
-                else:
-                    # 多张图，随机分配
-                    for product in products_to_update:
-                        chosen_image = random.choice(images)
-                        product.image.save(chosen_image.name, chosen_image, save=True)
-                        chosen_image.seek(0)
+            # 每张上传的图片只压缩、写入存储一次，商品只记录存储路径
+            if len(images) == 1:
+                # 一张图，覆盖所有选定商品
+                path = Product.store_image(images[0])
+                updated_count = products_to_update.update(image=path, updated_at=timezone.now())
+            else:
+                # 多张图，随机分配：先一次性抽好每个商品对应的图片，再按图片分组，每组一条 UPDATE
+                product_ids = list(products_to_update.values_list('pk', flat=True))
+                buckets = defaultdict(list)
+                for pk, index in zip(product_ids, random.choices(range(len(images)), k=len(product_ids))):
+                    buckets[index].append(pk)
+                # 没有抽中的图片不写入存储
+                paths = {index: Product.store_image(images[index]) for index in buckets}
+                now = timezone.now()
+                with transaction.atomic():
+                    for index, pks in buckets.items():
+                        Product.objects.filter(pk__in=pks).update(image=paths[index], updated_at=now)
+                updated_count = len(product_ids)
             
-            messages.success(request, f"成功更新了 {products_to_update.count()} 个商品的图片。")
+            messages.success(request, f"成功更新了 {updated_count} 个商品的图片。")
             return redirect('shop:product_list')
 
         except Exception as e:
@@ -515,16 +629,17 @@ def product_image_batch_update(request):
 def merchant_sales_report(request):
     shop = request.user.shop_account
     period = request.GET.get('period', 'today')
-    today = date.today()
+    today = timezone.localdate()
     if period == 'week':
         start_date = today - timedelta(days=today.weekday())
     elif period == 'month':
         start_date = today.replace(day=1)
     else:
         start_date = today
-    orders = Order.objects.filter(shop=shop, paid_at__date__gte=start_date, status__in=['PAID', 'PREPARING', 'READY_FOR_PICKUP', 'DELIVERING', 'DELIVERED'])
-    total_sales = orders.aggregate(Sum('total'))['total__sum'] or 0
-    total_orders = orders.count()
+    orders = Order.objects.filter(shop=shop, paid_at__gte=local_day_start(start_date), status__in=['PAID', 'PREPARING', 'READY_FOR_PICKUP', 'DELIVERING', 'DELIVERED'])
+    totals = DailySalesRollup.objects.filter(shop=shop, date__gte=start_date).aggregate(gross=Sum('gross'), orders=Sum('orders'))
+    total_sales = totals['gross'] or 0
+    total_orders = totals['orders'] or 0
     context = {
         'shop': shop,
         'total_sales': total_sales,
@@ -545,7 +660,7 @@ def product_sales_report(request):
         'product__price'
     ).annotate(
         total_quantity=Sum('quantity'),
-        total_revenue=Sum(F('quantity') * F('product__price'))
+        total_revenue=Sum('line_total')
     ).order_by('-total_quantity')
 
     context = {
@@ -655,8 +770,12 @@ def product_toggle(request, pk):
 @merchant_required
 def merchant_order_list(request):
     shop = request.user.shop_account
-    orders = Order.objects.filter(shop=shop).order_by('-created_at')
-    return render(request, 'shop/merchant_order_list.html', {'orders': orders, 'shop': shop})
+    # 列表只展示顾客、金额、状态和骑手，只取这些列并分页
+    orders = Order.objects.filter(shop=shop).select_related('user', 'rider__user').only(
+        'id', 'created_at', 'status', 'total', 'user__username', 'rider__user__username',
+    ).order_by('-created_at')
+    page_obj = Paginator(orders, 50).get_page(request.GET.get('page'))
+    return render(request, 'shop/merchant_order_list.html', {'orders': page_obj, 'page_obj': page_obj, 'shop': shop})
 
 # ===== 地址管理 =====
 @login_required
@@ -727,20 +846,33 @@ def checkout(request, address_id):
         return redirect('shop:cart_detail')
 
     shop = get_object_or_404(Shop, pk=shop_id)
-    subtotal = sum(Decimal(item['price']) * item['quantity'] for item in cart.values())
     delivery_fee = Decimal('1.00')
-    
-    summary = get_cart_summary(request.session)
+
+    coupon = get_session_coupon(request)
+    summary = get_cart_summary(request.session, coupon=coupon)
+    subtotal = Decimal(summary['total_price'])
     discount = Decimal(summary['discount'])
-    coupon = None
-    if summary['coupon']:
-        coupon = Coupon.objects.get(code=summary['coupon']['code'])
+    if not summary['coupon']:
+        coupon = None
 
     total = subtotal - discount + delivery_fee
     if total < 0:
         total = 0
 
-    order = Order.objects.create(
+    # 一次查出购物车内全部商品，校验库存后批量写入订单明细
+    products = Product.objects.in_bulk([int(pid) for pid in cart])
+    order_items = []
+    for pid, item in cart.items():
+        product = products.get(int(pid))
+        if product is None:
+            raise Http404("商品不存在")
+        if product.stock < item['quantity']:
+            messages.error(request, f"商品库存不足：{product.name}")
+            transaction.set_rollback(True)
+            return redirect('shop:cart_detail')
+        order_items.append(OrderItem(product=product, quantity=item['quantity'], unit_price=product.price))
+
+    order = Order(
         user=request.user, 
         shop=shop, 
         shipping_address=address, 
@@ -751,17 +883,15 @@ def checkout(request, address_id):
         delivery_fee=delivery_fee, 
         total=total
     )
+    order.set_items_summary(order_items)
+    order.save()
+    for order_item in order_items:
+        order_item.order = order
+    OrderItem.objects.bulk_create(order_items)
 
-    for pid, item in cart.items():
-        product = get_object_or_404(Product, pk=int(pid))
-        if product.stock < item['quantity']:
-            messages.error(request, f"商品库存不足：{product.name}")
-            transaction.set_rollback(True)
-            return redirect('shop:cart_detail')
-        OrderItem.objects.create(order=order, product=product, quantity=item['quantity'])
-    
     request.session['cart'] = {}
     request.session.pop('cart_shop_id', None)
+    request.session.pop('cart_shop_name', None)
     request.session.pop('coupon_id', None)
     
     messages.success(request, "订单已创建，请支付")
@@ -769,39 +899,46 @@ def checkout(request, address_id):
 
 @login_required
 def order_list(request):
-    orders = Order.objects.filter(user=request.user).prefetch_related('items__product').order_by('-created_at')
+    # 明细以冗余摘要显示，不再预取订单明细和商品
+    orders = Order.objects.filter(user=request.user).select_related('shop').only(
+        'id', 'status', 'total', 'created_at', 'item_count', 'items_summary', 'shop__name',
+    ).order_by('-created_at')
     return render(request, 'shop/order_list.html', {'orders': orders})
 
 @login_required
 def order_detail(request, pk):
-    order = get_object_or_404(Order.objects.prefetch_related('items__product'), pk=pk)
+    order = get_object_or_404(Order.objects.with_related(), pk=pk)
     is_customer = request.user == order.user
     is_shop_owner = is_merchant(request.user) and request.user.shop_account == order.shop
     is_order_rider = is_rider(request.user) and order.rider and request.user.rider_profile == order.rider
     if not (is_customer or is_shop_owner or is_order_rider):
         messages.error(request, "您没有权限查看此订单。")
         return redirect('shop:order_list')
-    for item in order.items.all():
-        item.subtotal = item.product.price * item.quantity
     return render(request, 'shop/order_detail.html', {'order': order})
 
 @login_required
 def order_pay(request, pk):
-    order = get_object_or_404(Order, pk=pk, user=request.user)
-    if order.status != 'PENDING':
-        messages.info(request, "该订单不能支付")
-        return redirect('shop:order_detail', pk=pk)
     with transaction.atomic():
-        for item in order.items.all():
-            product = item.product
+        # 先锁定订单行再检查状态，重复提交的支付请求会在这里排队，不会重复扣库存
+        order = get_object_or_404(Order.objects.select_for_update(), pk=pk, user=request.user)
+        if order.status != 'PENDING':
+            messages.info(request, "该订单不能支付")
+            return redirect('shop:order_detail', pk=pk)
+        # 锁定订单内商品，先全部校验库存再一次性批量扣减（2 条查询，与商品种类数无关）
+        items = list(order.items.only('product_id', 'quantity'))
+        products = Product.objects.select_for_update().only('id', 'name', 'stock').in_bulk(
+            [item.product_id for item in items]
+        )
+        now = timezone.now()
+        for item in items:
+            product = products[item.product_id]
             if product.stock < item.quantity:
                 messages.error(request, f"商品库存不足：{product.name}")
                 return redirect('shop:order_detail', pk=pk)
             product.stock -= item.quantity
-            product.save()
-        order.status = 'PAID'
-        order.paid_at = timezone.now()
-        order.save()
+            product.updated_at = now  # bulk_update 不会自动更新 auto_now 字段
+        Product.objects.bulk_update(products.values(), ['stock', 'updated_at'])
+        order.transition_to(Order.Status.PAID, paid_at=now)
     messages.success(request, "支付成功，库存已扣除")
     return redirect('shop:order_detail', pk=order.pk)
 
@@ -809,23 +946,32 @@ def order_pay(request, pk):
 @rider_required
 def rider_order_list(request):
     rider = request.user.rider_profile
-    available_orders = Order.objects.filter(status='PAID', rider__isnull=True).order_by('paid_at')
-    my_orders = Order.objects.filter(rider=rider, status='DELIVERING').order_by('accepted_at')
+    available_orders = Order.objects.with_related().filter(status='PAID', rider__isnull=True).order_by('paid_at')
+    my_orders = Order.objects.with_related().filter(rider=rider, status='DELIVERING').order_by('accepted_at')
     return render(request, 'shop/rider_order_list.html', {'available_orders': available_orders, 'my_orders': my_orders})
 
+RIDER_MAX_ACTIVE_ORDERS = 10
+
 @rider_required
 @transaction.atomic
 def rider_accept_order(request, pk):
-    rider = request.user.rider_profile
-    if rider.orders.filter(status='DELIVERING').count() >= 10:
-        messages.error(request, "您最多只能同时接10个订单。")
+    # 先锁住骑手行：同一骑手的并发接单在此排队，下面的计数在任何数据库隔离级别下都准确
+    rider = Rider.objects.select_for_update().get(pk=request.user.rider_profile.pk)
+    if rider.orders.filter(status=Order.Status.DELIVERING).count() >= RIDER_MAX_ACTIVE_ORDERS:
+        messages.error(request, f"您最多只能同时接{RIDER_MAX_ACTIVE_ORDERS}个订单。")
         return redirect('shop:rider_order_list')
-    order = get_object_or_404(Order, pk=pk, status='PAID', rider__isnull=True)
-    order.rider = rider
-    order.status = 'DELIVERING'
-    order.accepted_at = timezone.now()
-    order.save()
-    messages.success(request, f"成功接收订单 #{order.pk}")
+
+    # 条件 UPDATE：订单仍为已支付且未分配骑手时才会更新，两个骑手不会抢到同一单
+    updated = Order.objects.filter(pk=pk, status=Order.Status.PAID, rider__isnull=True).update(
+        status=Order.Status.DELIVERING, rider=rider, accepted_at=timezone.now(),
+    )
+    if not updated:
+        messages.error(request, "该订单已被接走或不可接单。")
+        return redirect('shop:rider_order_list')
+
+    # update() 不触发信号；PAID→DELIVERING 均计入销售额，汇总无需变动，只补发通知
+    notify_order_status(Order.objects.only('pk', 'user_id', 'shop_id', 'rider_id', 'status').get(pk=pk))
+    messages.success(request, f"成功接收订单 #{pk}")
     return redirect('shop:rider_order_list')
 
 @rider_required
@@ -834,13 +980,10 @@ def rider_update_order_status(request, pk):
     if request.method == 'POST':
         new_status = request.POST.get('status')
         if new_status == 'READY_FOR_PICKUP' and order.status == 'PAID':
-            order.status = new_status
-            order.save()
+            order.transition_to(Order.Status.READY_FOR_PICKUP)
             messages.success(request, "订单状态已更新为 ‘待取货’")
         elif new_status == 'DELIVERED' and order.status == 'DELIVERING':
-            order.status = new_status
-            order.delivered_at = timezone.now()
-            order.save()
+            order.transition_to(Order.Status.DELIVERED, delivered_at=timezone.now())
             messages.success(request, "订单已送达！")
         else:
             messages.error(request, "无效的状态更新。")
@@ -849,23 +992,26 @@ def rider_update_order_status(request, pk):
 @rider_required
 def rider_history(request):
     rider = request.user.rider_profile
-    completed_orders = Order.objects.filter(rider=rider, status='DELIVERED').order_by('-delivered_at')
-    total_earnings = completed_orders.aggregate(total=Sum('delivery_fee'))['total'] or 0
+    completed_orders = Order.objects.filter(rider=rider, status='DELIVERED').only('id', 'delivered_at').order_by('-delivered_at')
+    total_earnings = RiderDailyIncome.objects.filter(rider=rider).aggregate(total=Sum('income'))['total'] or 0
     context = {'completed_orders': completed_orders, 'total_earnings': total_earnings}
     return render(request, 'shop/rider_history.html', context)
 
 @rider_required
 def rider_income_dashboard(request):
     rider = request.user.rider_profile
-    today = timezone.now().date()
-    
-    # 总览数据
-    total_earnings = Order.objects.filter(rider=rider, status='DELIVERED').aggregate(total=Sum('delivery_fee'))['total'] or 0
-    total_orders = Order.objects.filter(rider=rider, status='DELIVERED').count()
+    today = timezone.localdate()
     
-    # 今日数据
-    today_earnings = Order.objects.filter(rider=rider, status='DELIVERED', delivered_at__date=today).aggregate(total=Sum('delivery_fee'))['total'] or 0
-    today_orders = Order.objects.filter(rider=rider, status='DELIVERED', delivered_at__date=today).count()
+    # 总览与今日数据用条件聚合一次取回
+    is_today = Q(date=today)
+    totals = RiderDailyIncome.objects.filter(rider=rider).aggregate(
+        total_income=Sum('income'), total_orders=Sum('orders'),
+        today_income=Sum('income', filter=is_today), today_orders=Sum('orders', filter=is_today),
+    )
+    total_earnings = totals['total_income'] or 0
+    total_orders = totals['total_orders'] or 0
+    today_earnings = totals['today_income'] or 0
+    today_orders = totals['today_orders'] or 0
 
     context = {
         'total_earnings': total_earnings,
@@ -878,7 +1024,8 @@ def rider_income_dashboard(request):
 # ===== 评价 =====
 @login_required
 def add_review(request, pk):
-    order = get_object_or_404(Order, pk=pk, user=request.user)
+    # 反向一对一随订单一起 JOIN 取回，下面的 hasattr 检查不再单独查询评价表
+    order = get_object_or_404(Order.objects.select_related('review'), pk=pk, user=request.user)
     if order.status != 'DELIVERED':
         messages.error(request, "订单尚未完成，不能评价。")
         return redirect('shop:order_detail', pk=order.pk)
@@ -901,7 +1048,8 @@ def add_review(request, pk):
 # ===== 客服工单 =====
 @login_required
 def ticket_list(request):
-    tickets = SupportTicket.objects.filter(user=request.user)
+    # 列表只显示编号、主题、状态和日期，不取问题描述等大字段
+    tickets = SupportTicket.objects.filter(user=request.user).only('id', 'subject', 'status', 'created_at')
     return render(request, 'shop/ticket_list.html', {'tickets': tickets})
 
 @login_required
@@ -934,9 +1082,11 @@ def ticket_detail(request, pk):
             message.ticket = ticket
             message.user = request.user
             message.save()
-            if is_owner and ticket.status == 'CLOSED':
-                ticket.status = 'IN_PROGRESS'
-                ticket.save()
+            if is_owner and ticket.status == SupportTicket.Status.CLOSED:
+                # 条件 UPDATE：只有仍处于关闭状态时才重新打开，不回写整行
+                SupportTicket.objects.filter(pk=ticket.pk, status=SupportTicket.Status.CLOSED).update(
+                    status=SupportTicket.Status.IN_PROGRESS, updated_at=timezone.now(),
+                )
             messages.success(request, "您的回复已发送。")
             return redirect('shop:ticket_detail', pk=pk)
     else:
@@ -948,26 +1098,30 @@ def support_inbox(request):
     if not (request.user.is_superuser or is_merchant(request.user)):
         messages.error(request, "您没有权限访问此页面。")
         return redirect('shop:shop_list')
-    if request.user.is_superuser:
-        tickets = SupportTicket.objects.all()
-    else:
-        tickets = SupportTicket.objects.all()
-    return render(request, 'shop/support_inbox.html', {'tickets': tickets})
+    # 模板显示提交人用户名：JOIN 取回，避免每条工单单独查询用户
+    tickets = SupportTicket.objects.select_related('user').only(
+        'id', 'subject', 'status', 'created_at', 'user__username',
+    )
+    page_obj = Paginator(tickets, 50).get_page(request.GET.get('page'))
+    return render(request, 'shop/support_inbox.html', {'tickets': page_obj, 'page_obj': page_obj})
 
 @login_required
 def ticket_update_status(request, pk):
     if not (request.user.is_superuser or is_merchant(request.user)):
         return redirect('shop:support_inbox')
-    ticket = get_object_or_404(SupportTicket, pk=pk)
+    tickets = SupportTicket.objects.filter(pk=pk)
     if request.method == 'POST':
         new_status = request.POST.get('status')
-        if new_status in ['OPEN', 'IN_PROGRESS', 'CLOSED']:
-            ticket.status = new_status
-            ticket.save()
-            messages.success(request, f"工单 #{ticket.pk} 状态已更新。")
+        if new_status in SupportTicket.Status.values:
+            # 只改状态，一条 UPDATE，无需先取出工单
+            if not tickets.update(status=new_status, updated_at=timezone.now()):
+                raise Http404
+            messages.success(request, f"工单 #{pk} 状态已更新。")
     return redirect('shop:ticket_detail', pk=pk)
 
 # ===== 后台管理 =====
+PASSWORD_HASH_WORKERS = os.cpu_count() or 1
+
 @superuser_required
 def user_batch_create(request):
     if request.method == 'POST':
@@ -983,61 +1137,82 @@ def user_batch_create(request):
         errors = []
         created_count = 0
         try:
-            decoded_file = csv_file.read().decode('utf-8-sig')
-            io_string = io.StringIO(decoded_file)
-            reader = csv.DictReader(io_string)
-
-            with transaction.atomic():
-                for i, row in enumerate(reader):
-                    line_num = i + 2
-                    username = row.get('username', '').strip()
-                    password = row.get('password', '').strip()
-                    user_type = row.get('user_type', 'customer').strip().lower()
-
-                    if not username or not password:
-                        errors.append(f"第 {line_num} 行: 'username' 和 'password' 字段不能为空。")
+            # 按行流式解码，不在内存中保留整份文件的原始字节和解码副本
+            rows = list(csv.DictReader(codecs.iterdecode(csv_file, 'utf-8-sig')))
+
+            # 预先一次查出已存在的用户名和文件中涉及的店铺，循环内只查内存
+            existing_usernames = set(User.objects.filter(
+                username__in=[row.get('username', '').strip() for row in rows]
+            ).values_list('username', flat=True))
+            shops_by_name = {}
+            for shop in Shop.objects.filter(name__in={row.get('shop_name', '').strip() for row in rows}).order_by('pk'):
+                shops_by_name.setdefault(shop.name, shop)
+
+            # 第一遍只校验并在内存中组装用户、骑手和店铺，全部通过后再批量写入
+            users = []
+            passwords = []
+            riders = []
+            new_shops = []
+            linked_shops = []
+            claimed_shop_names = set()
+            for i, row in enumerate(rows):
+                line_num = i + 2
+                username = row.get('username', '').strip()
+                password = row.get('password', '').strip()
+                user_type = row.get('user_type', 'customer').strip().lower()
+
+                if not username or not password:
+                    errors.append(f"第 {line_num} 行: 'username' 和 'password' 字段不能为空。")
+                    continue
+                
+                if username in existing_usernames:
+                    errors.append(f"第 {line_num} 行: 用户名 '{username}' 已存在。")
+                    continue
+                existing_usernames.add(username)
+
+                user = User(username=User.normalize_username(username))
+                if user_type == 'merchant':
+                    shop_name = row.get('shop_name', '').strip()
+                    if not shop_name:
+                        errors.append(f"第 {line_num} 行: 商家用户 '{username}' 必须关联一个 'shop_name'。")
                         continue
                     
-                    if User.objects.filter(username=username).exists():
-                        errors.append(f"第 {line_num} 行: 用户名 '{username}' 已存在。")
-                        continue
+                    shop = shops_by_name.get(shop_name)
+                    if shop is None:
+                        shop = Shop(name=shop_name, description=row.get('shop_description', ''), account=user)
+                        shops_by_name[shop_name] = shop
+                        new_shops.append(shop)
+                    else: # 如果店铺已存在
+                        if shop.account_id or shop_name in claimed_shop_names:
+                            errors.append(f"第 {line_num} 行: 店铺 '{shop_name}' 已被其他用户关联。")
+                            continue
+                        shop.account = user
+                        linked_shops.append(shop)
+                    claimed_shop_names.add(shop_name)
+                elif user_type == 'rider':
+                    riders.append(Rider(user=user))
 
-                    try:
-                        user = User.objects.create_user(username=username, password=password)
-                        
-                        if user_type == 'merchant':
-                            shop_name = row.get('shop_name', '').strip()
-                            if not shop_name:
-                                errors.append(f"第 {line_num} 行: 商家用户 '{username}' 必须关联一个 'shop_name'。")
-                                continue # 继续循环但此用户不会被完全创建
-                            
-                            shop, created = Shop.objects.get_or_create(
-                                name=shop_name,
-                                defaults={'description': row.get('shop_description', ''), 'account': user}
-                            )
-                            if not created: # 如果店铺已存在
-                                if shop.account and shop.account != user:
-                                    errors.append(f"第 {line_num} 行: 店铺 '{shop_name}' 已被其他用户关联。")
-                                    continue
-                                shop.account = user
-                                shop.save()
-                            
-                        elif user_type == 'rider':
-                            Rider.objects.create(user=user)
-                        
-                        created_count += 1
+                users.append(user)
+                passwords.append(password)
 
-                    except Exception as e:
-                        errors.append(f"第 {line_num} 行 ('{username}'): 创建用户时出错 - {e}")
-
-                if errors:
-                    # 如果有任何错误，则回滚整个事务
-                    transaction.set_rollback(True)
-                    for error in errors:
-                        messages.error(request, error)
-                else:
-                    messages.success(request, f"成功创建了 {created_count} 个用户。")
-                    return redirect('shop:shop_list') # 成功后跳转
+            if errors:
+                for error in errors:
+                    messages.error(request, error)
+            else:
+                # 校验全部通过后才计算密码哈希（最耗时的一步）。
+                # hashlib 计算 PBKDF2 时释放 GIL，多个线程可同时占用多个 CPU 核
+                with ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS) as executor:
+                    for user, encoded in zip(users, executor.map(make_password, passwords)):
+                        user.password = encoded
+                with transaction.atomic():
+                    # 主键由 bulk_create 回填，店铺和骑手的外键随后从关联的用户对象取得
+                    User.objects.bulk_create(users, batch_size=1000)
+                    Rider.objects.bulk_create(riders, batch_size=1000)
+                    Shop.objects.bulk_create(new_shops, batch_size=1000)
+                    Shop.objects.bulk_update(linked_shops, ['account'], batch_size=1000)
+                created_count = len(users)
+                messages.success(request, f"成功创建了 {created_count} 个用户。")
+                return redirect('shop:shop_list') # 成功后跳转
 
         except Exception as e:
             messages.error(request, f"处理文件时出错: {e}")
@@ -1059,19 +1234,44 @@ def order_import(request):
         errors = []
         created_count = 0
         try:
-            decoded_file = csv_file.read().decode('utf-8-sig')
-            io_string = io.StringIO(decoded_file)
-            reader = csv.DictReader(io_string)
-
+            # 按行流式解码，不在内存中保留整份文件的原始字节和解码副本
+            rows = list(csv.DictReader(codecs.iterdecode(csv_file, 'utf-8-sig')))
+
+            # 预先一次性查出文件涉及的用户、店铺和商品，循环内只查字典
+            users = User.objects.in_bulk({row.get('user_username', '').strip() for row in rows}, field_name='username')
+            shops = {}
+            for shop in Shop.objects.filter(name__in={row.get('shop_name', '').strip() for row in rows}).order_by('pk'):
+                shops.setdefault(shop.name, shop)
+            # items 列在这里解析一次（有 orjson 时用 orjson），下面逐行处理时直接复用
+            skus = set()
+            items_by_row = []
+            for row in rows:
+                try:
+                    items_data = json_loads(row.get('items', '[]').strip())
+                    skus.update(item['sku'] for item in items_data)
+                except (json.JSONDecodeError, KeyError, TypeError):
+                    items_data = None  # 格式错误在下面逐行处理时重新解析并报告
+                items_by_row.append(items_data)
+            products = {
+                (p.shop_id, p.sku): p
+                for p in Product.objects.filter(shop__in=shops.values(), sku__in=skus).only('id', 'shop_id', 'sku', 'price', 'name')
+            }
+            addresses = {}
+
+            orders_to_create = []
             with transaction.atomic():
-                for i, row in enumerate(reader):
+                for i, row in enumerate(rows):
                     line_num = i + 2
                     try:
-                        user = User.objects.get(username=row.get('user_username', '').strip())
-                        shop = Shop.objects.get(name=row.get('shop_name', '').strip())
+                        user = users.get(row.get('user_username', '').strip())
+                        if user is None:
+                            raise User.DoesNotExist
+                        shop = shops.get(row.get('shop_name', '').strip())
+                        if shop is None:
+                            raise Shop.DoesNotExist
                         
-                        # Get or create address
-                        address, _ = Address.objects.get_or_create(
+                        # Get or create address（同一文件中重复的地址只查询一次）
+                        address_fields = dict(
                             user=user,
                             contact_name=row.get('contact_name', '').strip(),
                             contact_phone=row.get('contact_phone', '').strip(),
@@ -1079,10 +1279,15 @@ def order_import(request):
                             city=row.get('city', '').strip(),
                             postal_code=row.get('postal_code', '').strip()
                         )
+                        address_key = tuple(address_fields.values())
+                        if address_key not in addresses:
+                            addresses[address_key], _ = Address.objects.get_or_create(**address_fields)
+                        address = addresses[address_key]
 
                         # 解析 items JSON
-                        items_str = row.get('items', '[]').strip()
-                        items_data = json.loads(items_str)
+                        items_data = items_by_row[i]
+                        if items_data is None:
+                            items_data = json_loads(row.get('items', '[]').strip())
                         if not items_data:
                             errors.append(f"第 {line_num} 行: 'items' 字段不能为空列表。")
                             continue
@@ -1091,10 +1296,12 @@ def order_import(request):
                         subtotal = Decimal('0.00')
                         order_items_to_create = []
                         for item_data in items_data:
-                            product = Product.objects.get(sku=item_data['sku'], shop=shop)
+                            product = products.get((shop.pk, item_data['sku']))
+                            if product is None:
+                                raise Product.DoesNotExist
                             quantity = int(item_data['quantity'])
                             subtotal += product.price * quantity
-                            order_items_to_create.append(OrderItem(product=product, quantity=quantity))
+                            order_items_to_create.append(OrderItem(product=product, quantity=quantity, unit_price=product.price))
 
                         delivery_fee = Decimal(row.get('delivery_fee', '1.00').strip())
                         total = subtotal + delivery_fee
@@ -1108,15 +1315,13 @@ def order_import(request):
                             'delivery_fee': delivery_fee,
                             'total': total,
                             'created_at': row.get('created_at') or timezone.now(),
-                            'paid_at': row.get('paid_at') or timezone.now(),
+                            'paid_at': parse_import_datetime(row.get('paid_at')) or timezone.now(),
                         }
                         
-                        order = Order.objects.create(**order_data)
-                        for item in order_items_to_create:
-                            item.order = order
-                        OrderItem.objects.bulk_create(order_items_to_create)
-                        
-                        created_count += 1
+                        # 先在内存中组装，全部行校验通过后统一批量写入
+                        order = Order(**order_data)
+                        order.set_items_summary(order_items_to_create)
+                        orders_to_create.append((order, order_items_to_create))
 
                     except User.DoesNotExist:
                         errors.append(f"第 {line_num} 行: 用户 '{row.get('user_username')}' 不存在。")
@@ -1124,7 +1329,7 @@ def order_import(request):
                         errors.append(f"第 {line_num} 行: 店铺 '{row.get('shop_name')}' 不存在。")
                     except Product.DoesNotExist:
                         errors.append(f"第 {line_num} 行: 商品SKU '{item_data['sku']}' 不存在或不属于该店铺。")
-                    except (json.JSONDecodeError, KeyError, ValueError) as e:
+                    except (json.JSONDecodeError, KeyError, ValueError, ValidationError) as e:
                         errors.append(f"第 {line_num} 行: 数据格式错误 - {e}")
 
                 if errors:
@@ -1132,6 +1337,18 @@ def order_import(request):
                     for error in errors:
                         messages.error(request, error)
                 else:
+                    orders = [order for order, _ in orders_to_create]
+                    Order.objects.bulk_create(orders, batch_size=500)
+                    # 主键已由 bulk_create 回填，所有订单的明细合并成一次批量插入
+                    order_items = []
+                    for order, items in orders_to_create:
+                        for item in items:
+                            item.order = order
+                            order_items.append(item)
+                    OrderItem.objects.bulk_create(order_items, batch_size=5000)
+                    # bulk_create 不触发信号，手动计入每日汇总
+                    add_orders_to_rollups(orders)
+                    created_count = len(orders)
                     messages.success(request, f"成功导入了 {created_count} 个订单。")
                     return redirect('shop:order_list')
 
@@ -1155,12 +1372,18 @@ def review_import(request):
         errors = []
         created_count = 0
         try:
-            decoded_file = csv_file.read().decode('utf-8-sig')
-            io_string = io.StringIO(decoded_file)
-            reader = csv.DictReader(io_string)
+            # 按行流式解码，不保留整份原始字节；解析出的行先收集起来，以便批量预取订单
+            rows = list(csv.DictReader(codecs.iterdecode(csv_file, 'utf-8-sig')))
+
+            # 涉及的订单及其已有评价各用一条查询取回，逐行只在内存中查找
+            order_ids = {(row.get('order_id') or '').strip() for row in rows}
+            order_ids = [int(oid) for oid in order_ids if oid.isdigit()]
+            orders = Order.objects.only('id', 'user_id', 'shop_id').in_bulk(order_ids)
+            reviewed = set(Review.objects.filter(order_id__in=order_ids).values_list('order_id', flat=True))
 
             with transaction.atomic():
-                for i, row in enumerate(reader):
+                reviews = []
+                for i, row in enumerate(rows):
                     line_num = i + 2
                     try:
                         order_id = row.get('order_id', '').strip()
@@ -1168,10 +1391,13 @@ def review_import(request):
                             errors.append(f"第 {line_num} 行: 'order_id' 字段不能为空。")
                             continue
 
-                        order = Order.objects.get(pk=order_id)
-                        
-                        # 检查该订单是否已经有评价
-                        if Review.objects.filter(order=order).exists():
+                        order = orders.get(int(order_id))
+                        if order is None:
+                            errors.append(f"第 {line_num} 行: 订单ID '{order_id}' 不存在。")
+                            continue
+
+                        # 检查该订单是否已经有评价（包括本文件前面的行）
+                        if order.pk in reviewed:
                             errors.append(f"第 {line_num} 行: 订单ID '{order_id}' 已存在评价，跳过。")
                             continue
 
@@ -1180,17 +1406,15 @@ def review_import(request):
                             errors.append(f"第 {line_num} 行: 'rating' 必须是1到5之间的整数。")
                             continue
 
-                        Review.objects.create(
+                        reviews.append(Review(
                             order=order,
-                            user=order.user, # 评价用户默认为订单用户
+                            user_id=order.user_id, # 评价用户默认为订单用户
                             rating=rating,
                             comment=row.get('comment', '').strip(),
                             created_at=row.get('created_at') or timezone.now()
-                        )
-                        created_count += 1
+                        ))
+                        reviewed.add(order.pk)
 
-                    except Order.DoesNotExist:
-                        errors.append(f"第 {line_num} 行: 订单ID '{order_id}' 不存在。")
                     except (ValueError, TypeError) as e:
                         errors.append(f"第 {line_num} 行: 数据格式错误 - {e}")
 
@@ -1199,6 +1423,10 @@ def review_import(request):
                     for error in errors:
                         messages.error(request, error)
                 else:
+                    Review.objects.bulk_create(reviews, batch_size=2000)
+                    # bulk_create 不触发信号，手动重算相关店铺评分
+                    recompute_shop_ratings(review.order.shop_id for review in reviews)
+                    created_count = len(reviews)
                     messages.success(request, f"成功导入了 {created_count} 条评价。")
                     return redirect('shop:order_list')
 
@@ -1214,7 +1442,7 @@ def register(request):
         form = RegistrationForm(request.POST)
         if form.is_valid():
             user = form.save()
-            login(request, user)
+            login(request, user, backend='shop.backends.ShopModelBackend')
             messages.success(request, "注册并登录成功")
             return redirect('shop:product_list')
     else:
@@ -1224,32 +1452,28 @@ def register(request):
 # ===== 用户资料 =====
 @login_required
 def profile(request):
+    user_form = password_form = None
     if request.method == 'POST':
         # Determine which form is being submitted
         if 'update_profile' in request.POST:
             user_form = UserUpdateForm(request.POST, instance=request.user)
-            password_form = PasswordChangeForm(request.user) # Keep it fresh
             if user_form.is_valid():
                 user_form.save()
                 messages.success(request, '您的个人信息已成功更新。')
                 return redirect('shop:profile')
         
         elif 'change_password' in request.POST:
-            user_form = UserUpdateForm(instance=request.user) # Keep it fresh
             password_form = PasswordChangeForm(request.user, request.POST)
             if password_form.is_valid():
                 user = password_form.save()
                 update_session_auth_hash(request, user)  # Important!
                 messages.success(request, '您的密码已成功更改。')
                 return redirect('shop:profile')
-        
-        else:
-            # Fallback for unexpected POST
-            user_form = UserUpdateForm(instance=request.user)
-            password_form = PasswordChangeForm(request.user)
 
-    else:
+    # 未提交的表单只在需要渲染页面时才创建，提交成功后直接重定向，不再构造另一个表单
+    if user_form is None:
         user_form = UserUpdateForm(instance=request.user)
+    if password_form is None:
         password_form = PasswordChangeForm(request.user)
 
     return render(request, 'shop/profile.html', {
@@ -1266,14 +1490,19 @@ def favorite_list(request):
 @login_required
 @require_POST
 def toggle_favorite(request, product_id):
-    product = get_object_or_404(Product, pk=product_id)
-    fav, created = Favorite.objects.get_or_create(user=request.user, product=product)
+    product = get_object_or_404(Product.objects.only('id', 'name'), pk=product_id)
+    # 先直接删除：已收藏时一条 DELETE 即完成；没有删到才新增，重复提交由 (user, product) 唯一约束兜底
+    deleted, _ = Favorite.objects.filter(user=request.user, product=product).delete()
 
-    if created:
-        messages.success(request, f"已将 ‘{product.name}’ 添加到您的收藏夹。")
-    else:
-        fav.delete()
+    if deleted:
         messages.success(request, f"已将 ‘{product.name}’ 从您的收藏夹中移除。")
+    else:
+        try:
+            with transaction.atomic():
+                Favorite.objects.create(user=request.user, product=product)
+        except IntegrityError:
+            pass  # 并发请求已经添加
+        messages.success(request, f"已将 ‘{product.name}’ 添加到您的收藏夹。")
     
     # Redirect back to the same page
     return redirect(request.META.get('HTTP_REFERER', 'shop:product_list'))
@@ -1286,25 +1515,36 @@ def notification_list(request):
 
 @login_required
 def mark_notification_as_read(request, notification_id):
-    notification = get_object_or_404(Notification, pk=notification_id, recipient=request.user)
-    notification.is_read = True
-    notification.save()
-    
-    if notification.link:
-        return redirect(notification.link)
+    notifications = Notification.objects.filter(pk=notification_id, recipient=request.user)
+    # 只取跳转链接；已读的通知不再重复写入
+    row = notifications.values_list('link', 'is_read').first()
+    if row is None:
+        raise Http404
+    link, is_read = row
+    if not is_read:
+        notifications.update(is_read=True)
+
+    if link:
+        return redirect(link)
     
     return redirect('shop:notification_list')
 
+@login_required
+@require_POST
+def mark_all_notifications_as_read(request):
+    Notification.objects.filter(recipient=request.user, is_read=False).update(is_read=True)
+    return redirect('shop:notification_list')
+
 # ===== 传统同步购物车操作 (后备) =====
 def add_to_cart(request, product_id):
-    product = get_object_or_404(Product, pk=product_id)
+    product = get_object_or_404(CART_PRODUCTS, pk=product_id)
     cart = request.session.get('cart', {})
     cart_shop_id = request.session.get('cart_shop_id')
-    if cart and cart_shop_id != product.shop.id:
-        messages.error(request, f"购物车中已有来自 ‘{Shop.objects.get(pk=cart_shop_id).name}’ 的商品，请先清空购物车再添加。")
+    if cart and cart_shop_id != product.shop_id:
+        messages.error(request, f"购物车中已有来自 ‘{cart_shop_name(request.session)}’ 的商品，请先清空购物车再添加。")
     else:
         if not cart:
-            request.session['cart_shop_id'] = product.shop.id
+            start_cart(request.session, product.shop)
         pid_str = str(product_id)
         if pid_str in cart:
             cart[pid_str]['quantity'] += 1
@@ -1329,6 +1569,7 @@ def update_cart_item(request, item_id):
     request.session['cart'] = cart
     if not cart:
         request.session.pop('cart_shop_id', None)
+        request.session.pop('cart_shop_name', None)
         request.session.pop('coupon_id', None)
     return redirect('shop:cart_detail')
 
@@ -1340,6 +1581,7 @@ def remove_cart_item(request, item_id):
     request.session['cart'] = cart
     if not cart:
         request.session.pop('cart_shop_id', None)
+        request.session.pop('cart_shop_name', None)
         request.session.pop('coupon_id', None)
     messages.success(request, "已移除商品")
     return redirect('shop:cart_detail')
@@ -1347,6 +1589,7 @@ def remove_cart_item(request, item_id):
 def clear_cart(request):
     request.session['cart'] = {}
     request.session.pop('cart_shop_id', None)
+    request.session.pop('cart_shop_name', None)
     request.session.pop('coupon_id', None)
     messages.success(request, "购物车已清空")
     return redirect('shop:cart_detail')
@@ -1364,8 +1607,8 @@ def apply_coupon(request):
         else:
             now = timezone.now()
             try:
-                coupon = Coupon.objects.get(code__iexact=code, shop_id=shop_id, is_active=True, valid_from__lte=now, valid_to__gte=now)
-                total_price = sum(Decimal(item['price']) * item['quantity'] for item in cart.values())
+                coupon = CART_COUPONS.get(code__iexact=code, shop_id=shop_id, is_active=True, valid_from__lte=now, valid_to__gte=now)
+                total_price = cart_total(cart)
                 if total_price < coupon.min_purchase_amount:
                     messages.error(request, f"订单金额未达到 ¥{coupon.min_purchase_amount} 的最低消费要求。")
                 else:
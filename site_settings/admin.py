@@ -22,25 +22,30 @@ class SiteSettingAdmin(admin.ModelAdmin):
         return obj.value
     masked_value.short_description = 'Value'
 
+    def get_object(self, request, object_id, from_field=None):
+        """记下数据库中的原值，保存时无需再查询一次。"""
+        obj = super().get_object(request, object_id, from_field)
+        if obj is not None:
+            obj._original_value = obj.value
+        return obj
+
     def get_form(self, request, obj=None, **kwargs):
         """在编辑表单中处理值的显示。"""
         form = super().get_form(request, obj, **kwargs)
         if obj and obj.key in SENSITIVE_KEYS:
-            # 预填充表单字段为隐藏后的值
-            form.base_fields['value'].initial = mask_value(obj.value)
+            # ModelForm 的 initial 取自实例，会覆盖字段的 initial，因此在表单实例上替换为隐藏后的值
+            class MaskedForm(form):
+                def __init__(self, *args, **kwargs):
+                    super().__init__(*args, **kwargs)
+                    self.initial['value'] = mask_value(self.instance._original_value)
+            return MaskedForm
         return form
 
     def save_model(self, request, obj, form, change):
         """在保存时决定是否更新值。"""
-        # 如果是敏感字段且值没有改变（仍然是隐藏格式），则不更新它
-        if obj.key in SENSITIVE_KEYS and form.cleaned_data['value'] == mask_value(obj.value):
-            # 值没有被用户修改，所以我们什么都不做来保留原始值
-            # 注意：我们不调用 super().save_model() 来跳过保存过程
-            # 但这会导致一个问题：如果其他字段被修改了，它们也不会被保存
-            # 一个更好的方法是只恢复'value'字段
-            
-            # 重新从数据库获取原始对象以确保我们有未修改的值
-            original_obj = SiteSetting.objects.get(pk=obj.pk)
-            obj.value = original_obj.value # 将值重置为原始值
+        # 敏感字段的值与表单初始的隐藏值相同，说明用户没有修改：
+        # 只把 value 恢复为原值，其他字段照常保存
+        if change and obj.key in SENSITIVE_KEYS and 'value' not in form.changed_data:
+            obj.value = obj._original_value
             
         super().save_model(request, obj, form, change)
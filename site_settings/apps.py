@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class SiteSettingsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'site_settings'
+
+    def ready(self):
+        # 导入并连接信号处理器
+        import site_settings.signals
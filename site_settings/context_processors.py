@@ -1,5 +1,12 @@
+from django.core.cache import cache
 from .models import SiteSetting
 
+# 配置很少变动，整表缓存起来，保存/删除配置时由信号清除
+SETTINGS_CACHE_KEY = 'site_settings_dict'
+
 def settings(request):
-    settings = SiteSetting.objects.all()
-    return {s.key: s.value for s in settings}
+    return cache.get_or_set(
+        SETTINGS_CACHE_KEY,
+        lambda: dict(SiteSetting.objects.values_list('key', 'value')),
+        timeout=300,
+    )
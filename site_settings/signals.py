@@ -0,0 +1,10 @@
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import SiteSetting
+from .context_processors import SETTINGS_CACHE_KEY
+
+@receiver([post_save, post_delete], sender=SiteSetting)
+def site_setting_changed_handler(sender, instance, **kwargs):
+    # 同时清除 shop.ai_service 按单个 key 缓存的值，修改后立即生效
+    cache.delete_many([SETTINGS_CACHE_KEY, f"site_setting:{instance.key}"])